@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+#coding=utf-8
+"""
+Template rendering benchmark. The templates are in project/apps/benchapp,
+they cover deep extend chains, many includes, loops over thousands of rows,
+heavy escaping and {{use}}/{{link}} plugins.
+
+    python template_bench.py run [-c case] [-t seconds] [-o result.json] [-b baseline.json]
+    python template_bench.py compare baseline.json result.json [--threshold 10]
+
+Each case is measured in three phases:
+
+* parse:   read and parse the template file (with extend and include)
+* compile: compile the parsed code to code object
+* render:  render the template by application, the compiled code is cached
+
+The result is ops/sec of each phase, the size of output and the max rss(KB)
+after the case is run. `compare` will report the phases whose ops/sec is
+decreased more than threshold percent, and exit with 1.
+"""
+
+import os
+import sys
+import time
+import json
+import resource
+import subprocess
+from optparse import OptionParser
+
+path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(path))
+
+VERSION = 1
+PHASES = ['parse', 'compile', 'render']
+CASES = [
+    ('extend', 'bench/extend.html'),
+    ('include', 'bench/include.html'),
+    ('rows', 'bench/rows.html'),
+    ('escape', 'bench/escape.html'),
+    ('assets', 'bench/assets.html'),
+]
+
+def get_vars():
+    rows = []
+    for i in range(2000):
+        rows.append({'id':i, 'name':'Item %d' % i, 'price':i * 1.5,
+            'status':['new', 'sold', 'hold'][i % 3],
+            'desc':'<b>%d</b> & "quoted" <i>text</i>' % i,
+            'html':u'a < b > c & d 中文'})
+    return {'title':'Benchmark <title>', 'rows':rows}
+
+def get_application():
+    from uliweb.manage import make_application
+    from uliweb.core.SimpleFrame import local, Request, Response
+    from werkzeug.test import EnvironBuilder
+
+    make_application(project_dir=os.path.join(path, 'project'), debug_console=False)
+    local.request = Request(EnvironBuilder('/').get_environ())
+    local.response = Response(content_type='text/html')
+    from uliweb import application
+    return application
+
+def measure(func, min_time, rounds=3):
+    """
+    Call func repeatedly at least min_time seconds, return the ops/sec of
+    the best round
+    """
+    best = 0
+    for i in range(rounds):
+        n = 0
+        begin = time.time()
+        while True:
+            func()
+            n += 1
+            t = time.time() - begin
+            if t >= min_time:
+                break
+        best = max(best, n / t)
+    return best
+
+def run_case(app, filename, vars, min_time):
+    from uliweb.core import template
+
+    env = app.get_template_env()
+    dirs = app.template_dirs
+    def parse():
+        t = template.Template('', vars, env, dirs)
+        t.set_filename(filename)
+        return t.get_parsed_code()
+
+    use_temp, fname, text = parse()
+    result = {}
+    result['parse'] = measure(parse, min_time)
+    result['compile'] = measure(lambda:compile(text, fname, 'exec'), min_time)
+    output = app.template(filename, vars)
+    result['render'] = measure(lambda:app.template(filename, vars), min_time)
+    result['size'] = len(output)
+    result['maxrss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def get_commit():
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=path,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return p.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+def run(cases=None, min_time=0.5):
+    app = get_application()
+    vars = get_vars()
+    data = {'version':VERSION, 'time':time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python':sys.version.split()[0], 'commit':get_commit(), 'cases':{}}
+    for name, filename in CASES:
+        if cases and name not in cases:
+            continue
+        data['cases'][name] = r = run_case(app, filename, vars, min_time)
+        print '%-10s parse %10.1f  compile %10.1f  render %10.1f ops/sec  size %8d  maxrss %8d' % (
+            name, r['parse'], r['compile'], r['render'], r['size'], r['maxrss'])
+    return data
+
+def compare(base, new, threshold=10):
+    """
+    Print the changes of ops/sec, and return the regressions, which are
+    [(case, phase, change percent)]
+    """
+    regressions = []
+    for name, filename in CASES:
+        if name not in base['cases'] or name not in new['cases']:
+            continue
+        b, n = base['cases'][name], new['cases'][name]
+        line = ['%-10s' % name]
+        for p in PHASES:
+            change = (n[p] - b[p]) * 100.0 / b[p]
+            flag = ''
+            if change < -threshold:
+                flag = '!'
+                regressions.append((name, p, change))
+            line.append('%s %+7.1f%%%-1s' % (p, change, flag))
+        print '  '.join(line)
+    return regressions
+
+def load(filename):
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def main(args=None):
+    parser = OptionParser(usage=__doc__.rstrip())
+    parser.add_option('-c', '--case', dest='cases', action='append', default=[],
+        help='Run the special case, it can be used more than once.')
+    parser.add_option('-t', '--time', dest='time', type='float', default=0.5,
+        help='Min seconds of each measuring round. Default is 0.5.')
+    parser.add_option('-o', '--output', dest='output',
+        help='Save the result to json file.')
+    parser.add_option('-b', '--baseline', dest='baseline',
+        help='Compare the result with the baseline json file.')
+    parser.add_option('--threshold', dest='threshold', type='float', default=10,
+        help='Decreased percent of ops/sec which will be treated as regression. Default is 10.')
+    options, args = parser.parse_args(args)
+
+    if not args or args[0] not in ('run', 'compare'):
+        parser.error('Command should be run or compare')
+
+    if args[0] == 'run':
+        data = run(options.cases, options.time)
+        if options.output:
+            f = open(options.output, 'w')
+            try:
+                json.dump(data, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+        if not options.baseline:
+            return 0
+        base, new = load(options.baseline), data
+    else:
+        if len(args) != 3:
+            parser.error('compare needs baseline and result json files')
+        base, new = load(args[1]), load(args[2])
+
+    print 'compare %s(%s) with %s(%s)' % (new.get('commit'), new.get('time'),
+        base.get('commit'), base.get('time'))
+    regressions = compare(base, new, options.threshold)
+    if regressions:
+        print '%d regressions found' % len(regressions)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,668 @@
+# How to test it?
+# easy_install nose
+# cd test
+# nosetests test_frame.py
+
+import os
+import sys
+import shutil
+import tempfile
+
+APP = 'frameapp'
+
+INIT = """
+counter = []
+
+def prepare_view_env(sender, env):
+    counter.append(1)
+    env['user'] = 'user%d' % len(counter)
+    env['url_for'] = None
+    if len(counter) % 2:
+        env['profile'] = None
+    else:
+        env['profile'] = {'name':'user%d' % len(counter)}
+"""
+
+SETTINGS = """
+[BINDS]
+frameapp.prepare_view_env = 'prepare_view_env', 'frameapp.prepare_view_env'
+"""
+
+VIEWS = """
+from uliweb import expose
+
+@expose('/')
+def index():
+    return 'index'
+
+@expose('/user')
+def show_user():
+    return '%s %s %s %s' % (user, env.user, request.path, url_for('frameapp.views.index'))
+
+def get_user():
+    return env['user']
+
+@expose('/profile')
+def show_profile():
+    if profile is None:
+        return 'None %s' % get_user()
+    return '%s %s %s' % (isinstance(profile, dict), profile['name'], get_user())
+
+@expose('/class')
+class Profile(object):
+    def user(self):
+        return '%s %s' % (user, isinstance(profile, dict))
+
+@expose('/greeting')
+def greeting():
+    return '%s' % hello
+
+@expose('/tgreeting')
+def tgreeting():
+    return application.template('greeting.html', {})
+"""
+
+def write(filename, text):
+    path = os.path.dirname(filename)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+
+TEMPLATES = {
+    'greeting.html':'{{=hello}}',
+}
+
+def make_project(path, views=VIEWS, settings=SETTINGS, init=INIT, templates=TEMPLATES, apps=None):
+    """
+    Create a project which has the test app and other installed apps, and 
+    return its apps directory
+    """
+    apps_dir = os.path.join(path, 'apps')
+    app_dir = os.path.join(apps_dir, APP)
+    write(os.path.join(apps_dir, 'settings.ini'),
+        "[GLOBAL]\nDEBUG = False\nINSTALLED_APPS = %r\n" % ((apps or []) + [APP]))
+    write(os.path.join(app_dir, '__init__.py'), init)
+    write(os.path.join(app_dir, 'settings.ini'), settings)
+    write(os.path.join(app_dir, 'views.py'), views)
+    for name, text in templates.items():
+        write(os.path.join(app_dir, 'templates', name), text)
+    return apps_dir
+
+_saved = {}
+
+def reset():
+    """
+    Dispatcher is installed only once in a process, so clean the global
+    state to let a new one to be created
+    """
+    from uliweb.core import SimpleFrame, rules, dispatch
+    from uliweb.core.matcher import IndexedMap
+
+    if not _saved:
+        _saved['receivers'] = dict([(k, list(v)) for k, v in dispatch._receivers.items()])
+    dispatch._receivers.clear()
+    dispatch._receivers.update(dict([(k, list(v)) for k, v in _saved['receivers'].items()]))
+
+    D = SimpleFrame.Dispatcher
+    if D.watcher:
+        thread = D.watcher.thread
+        D.watcher.stop()
+        if thread:
+            thread.join()
+        D.watcher = None
+    SimpleFrame.template.set_options(check_files=True)
+    D.installed = False
+    SimpleFrame.__global__.settings = SimpleFrame.pyini.Ini()
+    SimpleFrame.url_map = IndexedMap()
+    SimpleFrame.static_views.clear()
+    SimpleFrame.__app_dirs__.clear()
+    SimpleFrame.__app_alias__.clear()
+    SimpleFrame.clear_url_cache()
+    rules.clear_rules()
+    rules.__url_names__.clear()
+    tags = sys.modules.get('uliweb.contrib.template.tags')
+    if tags:
+        tags.CacheNode.__cache__ = None
+    for k in sys.modules.keys():
+        if k == APP or k.startswith(APP + '.'):
+            del sys.modules[k]
+
+def make_app(apps_dir, **kwargs):
+    from uliweb.manage import make_simple_application
+
+    reset()
+    return make_simple_application(apps_dir=apps_dir, dispatcher_kwargs=kwargs)
+
+def make_client(app):
+    from werkzeug.test import Client
+    from werkzeug import BaseResponse
+
+    return Client(app, BaseResponse)
+
+class TestViewEnv:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.app = make_app(make_project(self.path))
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_per_request_values(self):
+        r = self.client.get('/user')
+        assert r.data == 'user1 user1 /user /', r.data
+        r = self.client.get('/user')
+        assert r.data == 'user2 user2 /user /', r.data
+
+    def test_value_type_changed(self):
+        r = self.client.get('/profile')
+        assert r.data == 'None user1', r.data
+        r = self.client.get('/profile')
+        assert r.data == 'True user2 user2', r.data
+        r = self.client.get('/class/user')
+        assert r.data == 'user3 False', r.data
+        r = self.client.get('/class/user')
+        assert r.data == 'user4 True', r.data
+
+    def test_env_changed(self):
+        from uliweb import application
+
+        application.env['hello'] = 'hello'
+        r = self.client.get('/greeting')
+        assert r.data == 'hello', r.data
+        application.env['hello'] = 'world'
+        r = self.client.get('/greeting')
+        assert r.data == 'world', r.data
+
+    def test_template_env_changed(self):
+        from uliweb import application
+
+        application.env['hello'] = 'hello'
+        r = self.client.get('/tgreeting')
+        assert r.data == 'hello', r.data
+        application.env['hello'] = 'world'
+        r = self.client.get('/tgreeting')
+        assert r.data == 'world', r.data
+
+class TestFragmentCache:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        views = """
+from uliweb import expose
+
+@expose('/page')
+def page():
+    response.template = 'page.html'
+    return {}
+"""
+        templates = {'page.html':"""<html><head></head><body>
+{{cache 'links'}}{{link 'a.css'}}{{link 'b.js', to='bottomlinks'}}<p>fragment</p>{{end}}
+</body></html>"""}
+        apps = ['uliweb.contrib.staticfiles', 'uliweb.contrib.template', 'uliweb.contrib.cache']
+        self.app = make_app(make_project(self.path, views=views, settings='', 
+            templates=templates, apps=apps))
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_links(self):
+        first = self.client.get('/page').data
+        assert 'a.css' in first and 'b.js' in first, first
+        second = self.client.get('/page').data
+        assert first == second, (first, second)
+
+class TestWatcher:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        views = """
+from uliweb import expose
+
+@expose('/page')
+def page():
+    response.template = 'page.html'
+    return {}
+"""
+        settings = "[WATCHER]\nENABLE = True\nINTERVAL = 60\n"
+        self.apps_dir = make_project(self.path, views=views, settings=settings, 
+            templates={'page.html':'old'})
+        self.app = make_app(self.apps_dir)
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_files_changed(self):
+        from uliweb import application
+        from uliweb.core import template
+
+        #the watcher is started by the first request
+        assert not application.watcher.is_running()
+        assert template.__options__['check_files']
+        r = self.client.get('/page')
+        assert r.data == 'old', r.data
+        assert application.watcher.is_running()
+        assert not template.__options__['check_files']
+        if hasattr(os, 'fork'):
+            #watcher thread is not copied to the forked process
+            pid = os.fork()
+            if pid == 0:
+                os._exit(int(application.watcher.is_running()))
+            assert os.waitpid(pid, 0)[1] == 0
+
+        filename = os.path.join(self.apps_dir, APP, 'templates', 'page.html')
+        write(filename, 'new')
+        mtime = os.path.getmtime(filename) + 10
+        os.utime(filename, (mtime, mtime))
+        #cached template is not checked by mtime
+        r = self.client.get('/page')
+        assert r.data == 'old', r.data
+        assert filename in application.watcher.check()
+        r = self.client.get('/page')
+        assert r.data == 'new', r.data
+
+class TestHtmlMerge:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        views = """
+from uliweb import expose
+
+@expose('/page')
+def page():
+    response.template = 'page.html'
+    return {}
+"""
+        templates = {'page.html':"""<html><head><script src="/static/b.js"></script></head><body>
+{{link 'a.css'}}{{link 'b.js'}}{{link 'c.js', to='bottomlinks'}}</body></html>"""}
+        apps = ['uliweb.contrib.staticfiles', 'uliweb.contrib.template']
+        self.app = make_app(make_project(self.path, views=views, settings='', 
+            templates=templates, apps=apps))
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_cached_links(self):
+        from uliweb.contrib.template.tags import HtmlMerge
+
+        HtmlMerge.__cache__.clear()
+        first = self.client.get('/page').data
+        assert len(HtmlMerge.__cache__) == 1
+        assert first.count('b.js') == 1, first
+        assert '/static/a.css' in first and '/static/c.js' in first, first
+        assert self.client.get('/page').data == first
+        #static urls depend on the script name, so it's in the cache key
+        r = self.client.get('/page', base_url='http://localhost/sub/')
+        assert '/sub/static/a.css' in r.data, r.data
+        assert len(HtmlMerge.__cache__) == 2
+        HtmlMerge.__cache__.clear()
+        assert self.client.get('/page').data == first
+
+DISPATCH_INIT = """
+from uliweb import Middleware
+
+calls = []
+middleware_calls = []
+
+class M1(Middleware):
+    ORDER = 100
+    instances = 0
+
+    def __init__(self, application, settings):
+        M1.instances += 1
+
+    def process_request(self, request):
+        middleware_calls.append('m1.request')
+
+    def process_response(self, request, response):
+        middleware_calls.append('m1.response')
+        return response
+
+class M2(Middleware):
+    ORDER = 200
+
+    def process_request(self, request):
+        middleware_calls.append('m2.request')
+
+    def process_response(self, request, response):
+        middleware_calls.append('m2.response')
+        return response
+
+    def process_exception(self, request, e):
+        middleware_calls.append('m2.exception')
+"""
+
+DISPATCH_SETTINGS = """
+[MIDDLEWARES]
+m2 = 'frameapp.M2'
+m1 = 'frameapp.M1'
+"""
+
+DISPATCH_VIEWS = """
+from uliweb import expose
+from frameapp import calls
+
+def __begin__():
+    calls.append('begin')
+
+def __end__():
+    calls.append('end')
+
+@expose('/hello')
+def hello():
+    calls.append('hello')
+    return 'hello'
+
+@expose('/cls')
+class Cls(object):
+    def __begin__(self):
+        calls.append('cls.begin')
+
+    @expose('')
+    def index(self):
+        calls.append('cls.index')
+        return 'cls'
+"""
+
+class TestDispatch:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.app = make_app(make_project(self.path, views=DISPATCH_VIEWS, 
+            settings=DISPATCH_SETTINGS, init=DISPATCH_INIT))
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_endpoints(self):
+        from uliweb import application
+        from frameapp import calls
+
+        #endpoints are resolved at startup
+        info = application.endpoints['frameapp.views.hello']
+        assert application.resolve_endpoint('frameapp.views.hello') is info
+        assert info.appname == APP and info.function == 'hello'
+        assert info.hooks.mod_begin[0] == 'frameapp.views.__begin__'
+        assert info.hooks.cls_begin is None
+        info = application.endpoints['frameapp.views.Cls.index']
+        assert info.view_class.__name__ == 'Cls'
+        assert info.hooks.cls_begin[0] == 'frameapp.views.Cls.__begin__'
+
+        for i in range(2):
+            del calls[:]
+            assert self.client.get('/hello').data == 'hello'
+            assert calls == ['begin', 'hello', 'end'], calls
+            del calls[:]
+            assert self.client.get('/cls').data == 'cls'
+            assert calls == ['begin', 'cls.begin', 'cls.index', 'end'], calls
+
+    def test_reinstall(self):
+        from uliweb import application
+
+        assert 'frameapp.views.hello' in application.endpoints
+        assert application.view_hooks
+        path = tempfile.mkdtemp()
+        try:
+            #the endpoints and middlewares of the former application are not kept
+            make_app(make_project(path))
+            assert 'frameapp.views.hello' not in application.endpoints
+            info = application.endpoints['frameapp.views.index']
+            assert info.mod is sys.modules[APP + '.views']
+            assert [k for k in application.view_hooks if k[0] is not info.mod] == []
+            #the middleware chains are created again
+            assert application.middleware_chains.keys() == [()]
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def test_middleware_chain(self):
+        from uliweb import application
+        from frameapp import M1, M2, middleware_calls
+
+        #middlewares are sorted by order and created only once
+        assert application.middlewares == [M1, M2]
+        chain = application.middleware_chain
+        assert application.get_middleware_chain([M1, M2]) is chain
+        for i in range(2):
+            del middleware_calls[:]
+            assert self.client.get('/hello').data == 'hello'
+            assert middleware_calls == ['m1.request', 'm2.request', 
+                'm2.response', 'm1.response'], middleware_calls
+        assert M1.instances == 1
+        assert len(chain.exception) == 1
+
+class TestManifest:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.apps_dir = make_project(self.path, settings=SETTINGS + "[PARA]\nname = 'a'\n")
+        write(os.path.join(self.apps_dir, 'config.ini'), "[GLOBAL]\nMANIFEST = 'manifest.pkl'\n")
+        self.manifest_file = os.path.join(self.path, 'manifest.pkl')
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_manifest(self):
+        from uliweb import settings
+
+        #the manifest is enabled by apps/config.ini, and saved at first start
+        app = make_app(self.apps_dir)
+        assert app.manifest_file == self.manifest_file
+        assert app.manifest is None
+        assert os.path.exists(self.manifest_file)
+        app = make_app(self.apps_dir)
+        assert app.manifest is not None
+        assert settings.PARA.name == 'a'
+        r = make_client(app).get('/user')
+        assert r.data == 'user1 user1 /user /', r.data
+
+        #stale manifest will be rebuilt
+        filename = os.path.join(self.apps_dir, APP, 'settings.ini')
+        write(filename, SETTINGS + "[PARA]\nname = 'b'\n")
+        mtime = os.path.getmtime(filename) + 10
+        os.utime(filename, (mtime, mtime))
+        app = make_app(self.apps_dir)
+        assert app.manifest is None
+        assert settings.PARA.name == 'b'
+        app = make_app(self.apps_dir)
+        assert app.manifest is not None
+        assert settings.PARA.name == 'b'
+
+class TestLazyViews:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.apps_dir = make_project(self.path)
+        write(os.path.join(self.apps_dir, 'config.ini'), 
+            "[GLOBAL]\nMANIFEST = 'manifest.pkl'\nLAZY_VIEWS = True\n")
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_lazy_views(self):
+        #views are imported at startup if the manifest is not existed
+        app = make_app(self.apps_dir)
+        assert not app.is_lazy_views()
+        assert 'frameapp.views' in sys.modules
+
+        app = make_app(self.apps_dir)
+        assert app.is_lazy_views()
+        assert 'frameapp.views' not in sys.modules
+        assert 'frameapp.views.show_user' not in app.endpoints
+        r = make_client(app).get('/user')
+        assert r.data == 'user1 user1 /user /', r.data
+        assert 'frameapp.views' in sys.modules
+        assert 'frameapp.views.show_user' in app.endpoints
+
+URL_VIEWS = """
+from uliweb import expose
+
+@expose('/show/<id>')
+def show(id):
+    return id
+
+@expose('/urls')
+def urls():
+    from uliweb.core.SimpleFrame import url_builds
+
+    def get_urls():
+        return [url_for('frameapp.views.show', id=1), url_for(show, id=1), 
+            url_for('frameapp.views.show', id='a b'), 
+            url_for(show, id=1, _external=True)]
+    adapter = request.url_adapter
+    uncached = [adapter.build('frameapp.views.show', {'id':1}), 
+        adapter.build('frameapp.views.show', {'id':1}),
+        adapter.build('frameapp.views.show', {'id':'a b'}),
+        adapter.build('frameapp.views.show', {'id':1}, force_external=True)]
+    cached = get_urls()
+    assert get_urls() == cached == uncached, (cached, uncached)
+    assert len(url_builds) > 0
+    return ' '.join(cached)
+"""
+
+class TestUrlFor:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.app = make_app(make_project(self.path, views=URL_VIEWS, settings=''))
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_url_for(self):
+        r = self.client.get('/urls')
+        assert r.data == '/show/1 /show/1 /show/a%20b http://localhost/show/1', r.data
+        #built urls depend on the script name of the request
+        r = self.client.get('/urls', base_url='http://localhost/sub/')
+        assert r.data == '/sub/show/1 /sub/show/1 /sub/show/a%20b http://localhost/sub/show/1', r.data
+        r = self.client.get('/urls')
+        assert r.data == '/show/1 /show/1 /show/a%20b http://localhost/show/1', r.data
+
+class TestPathCache:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.apps_dir = make_project(self.path)
+        self.app = make_app(self.apps_dir)
+
+    def tearDown(self):
+        from uliweb.core.pathcache import path_cache
+
+        path_cache.check_mtime = False
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_path_cache(self):
+        from uliweb.core.pathcache import path_cache
+
+        path_cache.clear()
+        static_dir = os.path.join(self.apps_dir, APP, 'static')
+        #not found result is cached too
+        assert self.app.get_file('a.txt') is None
+        assert len(path_cache.cache) == 1
+        write(os.path.join(static_dir, 'a.txt'), 'a')
+        assert self.app.get_file('a.txt') is None
+        path_cache.clear()
+        assert len(path_cache.cache) == 0
+        filename = self.app.get_file('a.txt')
+        assert filename and os.path.samefile(filename, os.path.join(static_dir, 'a.txt'))
+
+        #in debug mode the directories mtime will be checked
+        path_cache.check_mtime = True
+        assert self.app.get_file('b.txt') is None
+        write(os.path.join(static_dir, 'b.txt'), 'b')
+        mtime = os.path.getmtime(static_dir) + 10
+        os.utime(static_dir, (mtime, mtime))
+        filename = self.app.get_file('b.txt')
+        assert filename and os.path.samefile(filename, os.path.join(static_dir, 'b.txt'))
+
+STREAM_VIEWS = """
+from uliweb import expose
+
+rendered = []
+
+def mark():
+    rendered.append(1)
+    return 'mark'
+
+@expose('/stream')
+def stream_page():
+    return application.stream('form.html', {'mark':mark})
+"""
+
+class TestStream:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        settings = "[ORM]\nCONNECTION = 'sqlite://'\n[SESSION_STORAGE]\ndata_dir = %r\n" % (
+            os.path.join(self.path, 'sessions'))
+        templates = {'form.html':'<form method="POST">{{=mark()}}</form>'}
+        apps = ['uliweb.contrib.session', 'uliweb.contrib.csrf', 'uliweb.contrib.orm']
+        self.app = make_app(make_project(self.path, views=STREAM_VIEWS, settings=settings, 
+            templates=templates, apps=apps))
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_stream(self):
+        from werkzeug.test import create_environ, run_wsgi_app
+
+        views = sys.modules[APP + '.views']
+        app_iter, status, headers = run_wsgi_app(self.app, create_environ('/stream'))
+        #the template is not rendered by the middlewares
+        assert status == '200 OK', status
+        assert views.rendered == []
+        cookies = [v for k, v in headers if k == 'Set-Cookie']
+        assert [x for x in cookies if x.startswith('_csrf_token=')], headers
+        text = ''.join(app_iter)
+        assert views.rendered == [1]
+        assert text == '<form method="POST">mark</form>', text
+
+TIMING_VIEWS = """
+from uliweb import expose
+
+@expose('/')
+def index():
+    return 'index'
+
+@expose('/error')
+def error_view():
+    raise ValueError('error')
+"""
+
+class TestTiming:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        settings = "[TIMING]\nENABLE = True\nSLOW_TIME = 0\n"
+        self.app = make_app(make_project(self.path, views=TIMING_VIEWS, settings=settings))
+        self.client = make_client(self.app)
+
+    def tearDown(self):
+        reset()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_exception(self):
+        from uliweb import application, settings
+        from uliweb.core import timing
+
+        collector = application.timing_collector
+        r = self.client.get('/')
+        assert r.data == 'index', r.data
+        assert timing.get_timings() is timing.null_timings
+
+        #in debug mode the exception is raised by the application
+        settings.GLOBAL.DEBUG = True
+        try:
+            self.client.get('/error')
+            assert False, 'ValueError should be raised'
+        except ValueError:
+            pass
+        assert timing.get_timings() is timing.null_timings
+        endpoints = [x['endpoint'] for x in collector.get_slow_requests()]
+        assert endpoints == [APP + '.views.error_view', APP + '.views.index'], endpoints
@@ -1751,6 +1751,240 @@ def test_self_manytomany():
     [<Group {'name':u'python','id':1}>]
     """
     
+def test_select_related():
+    """
+    >>> db = get_connection('sqlite://')
+    >>> db.echo = False
+    >>> db.metadata.drop_all()
+    >>> class Group(Model):
+    ...     name = Field(str)
+    >>> class User(Model):
+    ...     username = Field(str)
+    ...     group = Reference(Group)
+    >>> class Article(Model):
+    ...     title = Field(str)
+    ...     author = Reference(User)
+    ...     editor = Reference(User, collection_name='edited_articles')
+    >>> g = Group(name='python')
+    >>> g.save()
+    True
+    >>> a = User(username='limodou', group=g)
+    >>> a.save()
+    True
+    >>> b = User(username='user')
+    >>> b.save()
+    True
+    >>> Article(title='Test', author=a, editor=b).save()
+    True
+    >>> Article(title='Test2', author=a).save()
+    True
+    >>> objs = list(Article.all().select_related('author', 'author.group', 'editor'))
+    >>> Group.remove()
+    >>> User.remove()
+    >>> [(x.title, x.author.username, x.author.group.name) for x in objs]
+    [(u'Test', u'limodou', u'python'), (u'Test2', u'limodou', u'python')]
+    >>> objs[0].author is objs[1].author
+    True
+    >>> print repr(objs[0].editor), repr(objs[1].editor)
+    <User {'username':u'user','group':None,'id':2}> None
+    >>> list(Article.all().select_related('title'))
+    Traceback (most recent call last):
+    KindError: Property title of Model Article is not a Reference field
+    """
+    
+def test_prefetch_related():
+    """
+    >>> db = get_connection('sqlite://')
+    >>> db.echo = False
+    >>> db.metadata.drop_all()
+    >>> class Tag(Model):
+    ...     name = Field(str)
+    >>> class Article(Model):
+    ...     title = Field(str)
+    ...     tags = ManyToMany(Tag)
+    >>> t1 = Tag(name='python')
+    >>> t1.save()
+    True
+    >>> t2 = Tag(name='linux')
+    >>> t2.save()
+    True
+    >>> Article(title='Test', tags=[t1, t2]).save()
+    True
+    >>> Article(title='Test2', tags=[t2]).save()
+    True
+    >>> Article(title='Test3').save()
+    True
+    >>> objs = list(Article.all().prefetch_related('tags'))
+    >>> Tag.remove()
+    >>> [(x.title, [y.name for y in x.tags], x.tags.ids(), x.tags.count()) for x in objs]
+    [(u'Test', [u'python', u'linux'], [1, 2], 2), (u'Test2', [u'linux'], [2], 1), (u'Test3', [], [], 0)]
+    >>> objs[1].save()
+    False
+    >>> objs[1].tags.add(1)
+    True
+    >>> list(objs[1].tags)
+    []
+    >>> sorted(objs[1].tags.ids())
+    [1, 2]
+    >>> list(Article.all().prefetch_related('title'))
+    Traceback (most recent call last):
+    KindError: Property title of Model Article is not a ManyToMany field
+    """
+    
+def test_bulk_create():
+    """
+    >>> db = get_connection('sqlite://')
+    >>> db.echo = False
+    >>> db.metadata.drop_all()
+    >>> class Tag(Model):
+    ...     name = Field(str)
+    >>> class Article(Model):
+    ...     title = Field(str)
+    ...     status = Field(int, default=1)
+    ...     created = Field(datetime.datetime, auto_now_add=True)
+    ...     tags = ManyToMany(Tag)
+    >>> Tag.bulk_create([{'name':'python'}, {'name':'linux'}, Tag(name='orm')], batch_size=2)
+    3
+    >>> [x.name for x in Tag.all()]
+    [u'python', u'linux', u'orm']
+    >>> objs = [{'title':'a'}, {'title':'b', 'status':2}, Article(title='c')]
+    >>> Article.bulk_create(objs, batch_size=2, return_ids=True)
+    [1, 2, 3]
+    >>> objs[2].id, objs[2].is_saved()
+    (3, True)
+    >>> [(x.title, x.status, x.created is not None) for x in Article.all()]
+    [(u'a', 1, True), (u'b', 2, True), (u'c', 1, True)]
+    >>> a = Article(title='d', tags=[1, 2])
+    >>> Article.bulk_create([a])
+    1
+    >>> a.id, sorted(Article.get(4).tags.ids())
+    (4, [1, 2])
+    >>> #sqlite doesn't support RETURNING, so the instances are not saved
+    >>> from uliweb.orm import support_returning
+    >>> support_returning(db.dialect)
+    False
+    >>> from sqlalchemy.dialects import postgresql
+    >>> support_returning(postgresql.dialect(implicit_returning=True))
+    True
+    >>> t = Tag(name='bulk')
+    >>> Tag.bulk_create([t])
+    1
+    >>> t.id, t.is_saved(), Tag.count()
+    (None, False, 4)
+    >>> #the ids are fetched when post_save should be sent
+    >>> from uliweb.core import dispatch
+    >>> def post_save(sender, instance, created, **kwargs):
+    ...     print 'post_save', instance.id, created
+    >>> f = dispatch.bind('post_save', signal=Tag.tablename)(post_save)
+    >>> t = Tag(name='signal')
+    >>> Tag.bulk_create([t], send_signals=True)
+    post_save 5 True
+    1
+    >>> dispatch.unbind('post_save', post_save)
+    >>> t.name = 'signal1'
+    >>> t.save()
+    True
+    >>> Tag.count(), Tag.get(5).name
+    (5, u'signal1')
+    >>> Article.bulk_create([Tag(name='test')])
+    Traceback (most recent call last):
+    BadValueError: Can't support the data type <Tag {'name':u'test','id':None}>
+    """
+    
+def test_changed_values():
+    """
+    >>> db = get_connection('sqlite://')
+    >>> db.echo = False
+    >>> db.metadata.drop_all()
+    >>> class Tag(Model):
+    ...     name = Field(str)
+    >>> class Article(Model):
+    ...     title = Field(str)
+    ...     content = Field(str)
+    ...     tag = Reference(Tag)
+    >>> t = Tag(name='python')
+    >>> t.save()
+    True
+    >>> a = Article(title='Test', content='content')
+    >>> a.save()
+    True
+    >>> a = Article.get(1)
+    >>> a._changed_values
+    {}
+    >>> a.save()
+    False
+    >>> a.title = 'Test'
+    >>> a.save()
+    False
+    >>> a.content = 'new content'
+    >>> a.tag = t
+    >>> sorted(a._changed_values.items())
+    [('content', u'content'), ('tag', None), ('title', u'Test')]
+    >>> sorted(a._get_data().items())
+    [('content', u'new content'), ('id', 1), ('tag', 1)]
+    >>> sorted(a._old_values.items())
+    [('content', 'content'), ('id', 1), ('tag', None), ('title', 'Test')]
+    >>> a.save()
+    True
+    >>> a._changed_values
+    {}
+    >>> Article.get(1)
+    <Article {'title':u'Test','content':u'new content','tag':<ReferenceProperty:1>,'id':1}>
+    >>> b = Article(id=1, title='Test1')
+    >>> b.save()
+    True
+    >>> Article.get(1).title
+    u'Test1'
+    """
+    
+def test_load_obj():
+    """
+    >>> db = get_connection('sqlite://')
+    >>> db.echo = False
+    >>> db.metadata.drop_all()
+    >>> class Tag(Model):
+    ...     name = Field(str)
+    >>> class Article(Model):
+    ...     title = Field(str)
+    ...     price = Field(float)
+    ...     date = Field(datetime.date)
+    ...     tag = Reference(Tag)
+    >>> t = Tag(name='python')
+    >>> t.save()
+    True
+    >>> Article(title='Test', price=10.5, date='2012-01-01', tag=t).save()
+    True
+    >>> a = Article.get(1)
+    >>> sorted(a.__dict__.keys())
+    ['_row_']
+    >>> a.title, a.date
+    (u'Test', datetime.date(2012, 1, 1))
+    >>> sorted(a.__dict__.keys())
+    ['_date_', '_row_', '_title_']
+    >>> a.tag
+    <Tag {'name':u'python','id':1}>
+    >>> a
+    <Article {'title':u'Test','price':10.5,'date':datetime.date(2012, 1, 1),'tag':<ReferenceProperty:1>,'id':1}>
+    >>> a.save()
+    False
+    >>> a.price = 20.0
+    >>> a._get_data()
+    {'price': 20.0, 'id': 1}
+    >>> a.save()
+    True
+    >>> b = Article.__new__(Article)
+    >>> b.__dict__.update(Article.get(1).__getstate__())
+    >>> sorted(b.__dict__.keys())
+    ['_RESOLVED_tag_', '_changed_values', '_date_', '_id_', '_price_', '_tag_', '_title_']
+    >>> b
+    <Article {'title':u'Test','price':20.0,'date':datetime.date(2012, 1, 1),'tag':<ReferenceProperty:1>,'id':1}>
+    >>> b.title = 'Test1'
+    >>> b.save()
+    True
+    >>> Article.get(1).title
+    u'Test1'
+    """
+    
 def test_sequence():
     """
     >>> from sqlalchemy import Sequence
@@ -0,0 +1,62 @@
+# How to test it?
+# easy_install nose
+# cd test
+# nosetests test_profile.py
+
+import os
+import time
+import thread
+import shutil
+import tempfile
+import threading
+
+from uliweb.wsgi.profile import Sampler, request_dump
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(100))
+
+class TestSampler:
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.sampler = Sampler(interval=0.002, dump_dir=self.path, 
+            flush_interval=0, trigger_interval=0.05)
+        self.sampler.start()
+
+    def tearDown(self):
+        self.sampler.stop()
+        self.sampler.thread.join()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_trigger(self):
+        ident = thread.get_ident()
+        self.sampler.begin(ident)
+        busy(0.1)
+        self.sampler.end(ident, 'busy')
+        assert self.sampler.active == {}
+
+        #the stacks will only be written when the dump is requested
+        filename = os.path.join(self.path, 'sampling-%d.txt' % os.getpid())
+        time.sleep(0.1)
+        assert not os.path.exists(filename)
+        files = request_dump(self.path, timeout=2)
+        assert files == [filename], files
+        lines = open(filename).read().splitlines()
+        assert lines and all(x.startswith('busy;') for x in lines), lines
+        assert [x for x in lines if 'busy' in x.split(';')[-1]], lines
+
+    def test_threads(self):
+        def request(i):
+            ident = thread.get_ident()
+            for j in range(20):
+                self.sampler.begin(ident)
+                busy(0.002)
+                self.sampler.end(ident, 'request%d' % i)
+
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        assert self.sampler.active == {}
+        names = set([x.split(';', 1)[0] for x in self.sampler.collapsed()])
+        assert names <= set(['request%d' % i for i in range(4)]), names
@@ -0,0 +1,165 @@
+from uliweb.core.template import *
+
+def test_block_marks():
+    """
+    Block marks are only kept in stream code, so the literals around block
+    boundaries are merged in normal code
+    
+    >>> text = "{{block a}}A{{end}}B{{block c}}C{{end}}"
+    >>> print Template(text).parse()
+    #coding=utf-8
+    out.write('ABC', escape=False)
+    <BLANKLINE>
+    >>> '__block__' in Template(text).parse(stream=True)
+    True
+    >>> Template(text)()
+    'ABC'
+    >>> t = Template(text)
+    >>> t.callbacks = []    #nodes of uliweb.contrib.template may add htmlmerge
+    >>> list(t.stream())
+    ['A', 'B', 'C']
+    """
+
+def _write(path, name, text, delta=0):
+    import os, time
+    filename = os.path.join(path, name)
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+    #make sure the mtime is changed
+    mtime = int(time.time()) + delta
+    os.utime(filename, (mtime, mtime))
+    return filename
+
+def test_compiled_cache():
+    """
+    Compiled template code is cached in memory, the result is the same as
+    rendering without cache, and it'll be compiled again when the template
+    or its depend files are changed
+    
+    >>> import tempfile, shutil
+    >>> from uliweb.core import template as T
+    >>> path = tempfile.mkdtemp()
+    >>> f = _write(path, 'inc.html', '<b>{{=name}}</b>')
+    >>> f = _write(path, 'page.html', '{{include "inc.html"}} & {{=name}}')
+    >>> T.clear_cache()
+    >>> T.template_file('page.html', {'name':'<a>'}, dirs=[path])
+    '<b>&lt;a&gt;</b> & &lt;a&gt;'
+    >>> len(T.__compiled_templates__)
+    1
+    >>> T.template_file('page.html', {'name':'c'}, dirs=[path])
+    '<b>c</b> & c'
+    >>> T.set_options(cache_size=0)
+    >>> T.template_file('page.html', {'name':'c'}, dirs=[path])
+    '<b>c</b> & c'
+    >>> T.set_options(cache_size=500)
+    >>> f = _write(path, 'inc.html', '<i>{{=name}}</i>', 10)
+    >>> T.template_file('page.html', {'name':'c'}, dirs=[path])
+    '<i>c</i> & c'
+    
+    If the parameters of include are not literals, the parsed code depends on
+    vars, so the template can't be cached
+    
+    >>> f = _write(path, 'dyn.html', '{{include name}}')
+    >>> t = T.Template('', {'name':'inc.html'}, dirs=[path])
+    >>> t.set_filename('dyn.html')
+    >>> t()
+    '<i>inc.html</i>'
+    >>> t.cacheable
+    False
+    >>> T.__compiled_templates__.get(t.get_cache_key()) is None
+    True
+    >>> T.clear_cache()
+    >>> shutil.rmtree(path)
+    """
+
+def test_temp_dir():
+    """
+    Compiled code can be saved to the template temp dir, and it'll be loaded
+    from there if the files are not changed
+    
+    >>> import os, tempfile, shutil
+    >>> from uliweb.core import template as T
+    >>> path = tempfile.mkdtemp()
+    >>> f = _write(path, 'inc.html', '<b>{{=name}}</b>')
+    >>> filename = _write(path, 'page.html', '{{include "inc.html"}} & {{=name}}')
+    >>> T.use_tempdir(os.path.join(path, 'temp'))
+    >>> T.clear_cache()
+    >>> T.template_file('page.html', {'name':'c'}, dirs=[path])
+    '<b>c</b> & c'
+    >>> temp = T.get_temp_template(filename)
+    >>> files, text, code = T.load_temp_template(temp)
+    >>> [os.path.basename(x[0]) for x in files]
+    ['page.html', 'inc.html']
+    >>> T.clear_cache()
+    >>> T.template_file('page.html', {'name':'c'}, dirs=[path])
+    '<b>c</b> & c'
+    >>> f = _write(path, 'inc.html', '<i>{{=name}}</i>', 10)
+    >>> T.load_temp_template(temp) is None
+    True
+    >>> T.template_file('page.html', {'name':'c'}, dirs=[path])
+    '<i>c</i> & c'
+    >>> #the temp file is unique, so threads can save the same template
+    >>> import threading
+    >>> files, text, code = T.load_temp_template(temp)
+    >>> def save():
+    ...     for i in range(20):
+    ...         T.save_temp_template(temp, files, text, code)
+    >>> threads = [threading.Thread(target=save) for i in range(4)]
+    >>> for t in threads: t.start()
+    >>> for t in threads: t.join()
+    >>> T.load_temp_template(temp)[1] == text
+    True
+    >>> [x for x in os.listdir(os.path.dirname(temp)) if x.endswith('.tmp')]
+    []
+    >>> T.set_options(use_temp_dir=False)
+    >>> T.clear_cache()
+    >>> shutil.rmtree(path)
+    """
+
+def test_compile_file():
+    """
+    compile_file() is used to precompile templates, the template which
+    depends on vars will be skipped
+    
+    >>> import os, tempfile, shutil
+    >>> from uliweb.core import template as T
+    >>> path = tempfile.mkdtemp()
+    >>> f = _write(path, 'inc.html', '<b>{{=name}}</b>')
+    >>> filename = _write(path, 'page.html', '{{include "inc.html"}} & {{=name}}')
+    >>> T.use_tempdir(os.path.join(path, 'temp'))
+    >>> temp = T.get_temp_template(filename)
+    >>> T.compile_file('page.html', dirs=[path]) == filename
+    True
+    >>> os.path.exists(temp)
+    True
+    >>> f = _write(path, 'dyn.html', '{{include name}}')
+    >>> T.compile_file('dyn.html', dirs=[path]) is None
+    True
+    >>> T.set_options(use_temp_dir=False)
+    >>> T.clear_cache()
+    >>> shutil.rmtree(path)
+    """
+
+def test_out():
+    """
+    Out escapes text the same as cgi.escape, and adjacent literals are merged
+    
+    >>> import cgi
+    >>> from uliweb.core import template as T
+    >>> for s in ['abc', '<a href="x">&</a>', '', '&amp;']:
+    ...     print T.escape_html(s) == cgi.escape(s), T.escape_html(s)
+    True abc
+    True &lt;a href="x"&gt;&amp;&lt;/a&gt;
+    True 
+    True &amp;amp;
+    >>> print T.Template('a{{block x}}b{{end}}{{=x}}c{{<<x}}').parse()
+    #coding=utf-8
+    out.write('ab', escape=False)
+    out.write(x)
+    out.write('c', escape=False)
+    out.write(x, escape=False)
+    <BLANKLINE>
+    >>> T.template('{{=a}} {{=b}} {{=c}} {{<<d}}', {'a':u'\\u4e2d<', 'b':1, 'c':None, 'd':'<i>'})
+    '\\xe4\\xb8\\xad&lt; 1 None <i>'
+    """
@@ -27,4 +27,76 @@ def test_1():
     ...         return {}
     >>> rules.merge_rules()
     [('__main__', '__main__.TestView.index', '/test', {}), ('__main__', '__main__.TestView.pnt', '/print', {}), ('__main__', '__main__.TestView.ttt', '/ttt', {}), ('__main__', '__main__.view', '/', {}), ('__main__', '__main__.view', '/hello', {})]
-    """
\ No newline at end of file
+    """
+def test_indexed_map():
+    """
+    >>> from werkzeug.routing import Map, Rule
+    >>> from uliweb.core.matcher import IndexedMap
+    >>> def make(cls):
+    ...     return cls([Rule('/', endpoint='index'),
+    ...         Rule('/blog/', endpoint='blog'),
+    ...         Rule('/blog/<int:id>', endpoint='blog.view'),
+    ...         Rule('/blog/<name>', endpoint='blog.name'),
+    ...         Rule('/blog/new', endpoint='blog.new', methods=['POST']),
+    ...         Rule('/<path:p>', endpoint='page'),
+    ...         Rule('/static/<path:filename>', endpoint='static'),
+    ...     ]).bind('example.com', '/')
+    >>> def match(adapter, path, method='GET'):
+    ...     try:
+    ...         return adapter.match(path, method)
+    ...     except Exception, e:
+    ...         return e.__class__.__name__
+    >>> a, b = make(Map), make(IndexedMap)
+    >>> for p, m in [('/', 'GET'), ('/blog', 'GET'), ('/blog/', 'GET'), ('/blog/12', 'GET'),
+    ...     ('/blog/new', 'GET'), ('/blog/new', 'POST'), ('/static/a/b.css', 'GET'), ('/about', 'GET')]:
+    ...     x, y = match(a, p, m), match(b, p, m)
+    ...     print p, m, y, x == y
+    / GET ('index', {}) True
+    /blog GET RequestRedirect True
+    /blog/ GET ('blog', {}) True
+    /blog/12 GET ('blog.view', {'id': 12}) True
+    /blog/new GET ('blog.name', {'name': u'new'}) True
+    /blog/new POST ('blog.new', {}) True
+    /static/a/b.css GET ('static', {'filename': u'a/b.css'}) True
+    /about GET ('page', {'p': u'about'}) True
+    """
+
+def test_indexed_map_update():
+    """
+    Rules can be added after matching, the index will be rebuilt and
+    published in one step, so matching in other threads always sees a
+    complete index
+    
+    >>> import threading
+    >>> from werkzeug.routing import Rule
+    >>> from uliweb.core.matcher import IndexedMap
+    >>> m = IndexedMap([Rule('/', endpoint='index')])
+    >>> a = m.bind('example.com', '/')
+    >>> a.match('/')
+    ('index', {})
+    >>> m.add(Rule('/about', endpoint='about'))
+    >>> m._remap
+    True
+    >>> a.match('/about')
+    ('about', {})
+    >>> m._remap
+    False
+    >>> errors = []
+    >>> def run():
+    ...     for i in range(500):
+    ...         try:
+    ...             m.bind('example.com', '/').match('/')
+    ...         except Exception, e:
+    ...             errors.append(e)
+    >>> threads = [threading.Thread(target=run) for i in range(4)]
+    >>> for t in threads:
+    ...     t.start()
+    >>> for i in range(100):
+    ...     m.add(Rule('/page%d/<id>' % i, endpoint='page%d' % i))
+    >>> for t in threads:
+    ...     t.join()
+    >>> errors
+    []
+    >>> a.match('/page99/1')
+    ('page99', {'id': u'1'})
+    """
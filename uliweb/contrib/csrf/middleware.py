@@ -32,6 +32,10 @@ class CSRFMiddleware(Middleware):
         if getattr(response, 'csrf_pass', False):
             return response
 
+        #streamed response will be rendered while it's sent, so don't read it
+        if response.is_streamed:
+            return response
+
         if response.headers['Content-Type'].split(';')[0] in _HTML_TYPES:
 
             def add_csrf_field(match):
@@ -14,6 +14,11 @@ class SessionMiddle(Middleware):
         self.session_storage_type = settings.SESSION.type
         self.timeout = settings.SESSION.timeout
         Session.force = settings.SESSION.force
+        serial_cls_path = settings.SESSION.serial_cls
+        if serial_cls_path:
+            self.serial_cls = import_attr(serial_cls_path)
+        else:
+            self.serial_cls = None
         
         #process Cookie options
         SessionCookie.default_domain = settings.SESSION_COOKIE.domain
@@ -31,13 +36,8 @@ class SessionMiddle(Middleware):
         key = request.cookies.get(SessionCookie.default_cookie_id)
         if not key:
             key = request.values.get(SessionCookie.default_cookie_id)
-        serial_cls_path = settings.SESSION.serial_cls
-        if serial_cls_path:
-            serial_cls = import_attr(serial_cls_path)
-        else:
-            serial_cls = None
         session = Session(key, storage_type=self.session_storage_type, 
-            options=self.options, expiry_time=self.timeout, serial_cls=serial_cls)
+            options=self.options, expiry_time=self.timeout, serial_cls=self.serial_cls)
         request.session = session
 
     def process_response(self, request, response):
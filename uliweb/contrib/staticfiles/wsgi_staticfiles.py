@@ -36,24 +36,32 @@ class StaticFilesMiddleware(SharedDataMiddleware):
             from werkzeug.exceptions import Forbidden, NotFound
             from uliweb.utils.common import pkg
             
+            from uliweb.core.pathcache import path_cache
+            
             app = self.app
             f = None
             if dir:
                 fname = os.path.normpath(os.path.join(dir, filename)).replace('\\', '/')
                 if not fname.startswith(dir):
                     return Forbidden("You can only visit the files under static directory."), None
-                if os.path.exists(fname):
-                    f = fname
+                f = path_cache.get(('static', fname), 
+                    lambda:os.path.exists(fname) and fname or None,
+                    lambda:[os.path.dirname(fname)])
             else:
-                for p in reversed(app.apps):
-                    fname = os.path.normpath(os.path.join('static', filename)).replace('\\', '/')
-                    if not fname.startswith('static/'):
-                        return Forbidden("You can only visit the files under static directory."), None
-                    
-                    ff = pkg.resource_filename(p, fname)
-                    if os.path.exists(ff):
-                        f = ff
-                        break
+                fname = os.path.normpath(os.path.join('static', filename)).replace('\\', '/')
+                if not fname.startswith('static/'):
+                    return Forbidden("You can only visit the files under static directory."), None
+                
+                def resolve():
+                    for p in reversed(app.apps):
+                        ff = pkg.resource_filename(p, fname)
+                        if os.path.exists(ff):
+                            return ff
+                
+                def watch_dirs():
+                    return [os.path.dirname(pkg.resource_filename(p, fname)) for p in app.apps]
+                
+                f = path_cache.get(('static', fname, tuple(app.apps)), resolve, watch_dirs)
             
             if f:
                 return f, self._opener(f)
@@ -1,12 +1,17 @@
 def startup_installed(sender):
     from uliweb.core import template
-    from tags import LinkNode, UseNode
+    from tags import LinkNode, UseNode, CacheNode, HtmlMerge, register_marks
     
     if sender.settings.TEMPLATE.USE_TEMPLATE_TEMP_DIR:
         template.use_tempdir(sender.settings.TEMPLATE.TEMPLATE_TEMP_DIR)
+    template.set_options(cache_size=sender.settings.TEMPLATE.get('CACHE_SIZE', 500),
+        buffer_size=sender.settings.TEMPLATE.get('BUFFER_SIZE', 8192))
         
     template.register_node('link', LinkNode)
     template.register_node('use', UseNode)
+    template.register_node('cache', CacheNode)
+    register_marks()
+    HtmlMerge.__cache__.clear()
     
     template.BEGIN_TAG = sender.settings.TEMPLATE.BEGIN_TAG
     template.END_TAG = sender.settings.TEMPLATE.END_TAG
@@ -1,5 +1,7 @@
 import os
 import re
+import uuid
+from hashlib import md5
 from uliweb.utils.common import log
 from uliweb.core.template import *
 from uliweb import functions
@@ -8,6 +10,8 @@ r_links = re.compile('<link\s+.*?\s*href\s*=\s*"?(.*?)["\s>]|<script\s+.*?\s*src
 r_head = re.compile('(?i)<head>(.*?)</head>', re.DOTALL)
 r_top = re.compile('<!--\s*toplinks\s*-->')
 r_bottom = re.compile('<!--\s*bottomlinks\s*-->')
+r_head_begin = re.compile('(?i)<head>')
+r_head_end = re.compile('(?i)(?=</head>)')
 
 class UseModuleNotFound(Exception): pass
 class TemplateDefineError(Exception): pass
@@ -149,7 +153,119 @@ class UseNode(LinkNode):
                         UseNode.use(vars, env, d, **kw)
                 
     
+class CacheNode(BaseBlockNode):
+    """
+    Fragment cache node, the rendered text will be saved in the cache of
+    uliweb.contrib.cache, the format is:
+    
+        {{cache "sidebar", user.id, timeout=300, tags=['menu']}}...{{end}}
+        
+    The first argument is the name of the fragment, other positional arguments
+    are used to vary the cache key. Fragments can be invalidated by tags via
+    invalidate_cache_tags(). If the fragment is found in cache, the code in it 
+    will not be executed, so the links added by {{link}} and {{use}} in it are
+    saved with the text, and they'll be added to __links__ again.
+    """
+    __cache__ = None
+    
+    def __init__(self, value=None, content=None, template=None):
+        BaseBlockNode.__init__(self, content=content)
+        self.value = value
+        
+    @staticmethod
+    def init(template):
+        template.add_exec_env('_cache_begin', CacheNode.begin_fragment)
+        template.add_exec_env('_cache_end', CacheNode.end_fragment)
+        template.add_exec_env('__fragments__', [])
+        
+    def __str__(self):
+        return 'if _cache_begin(out, __fragments__, _env, %s):\n%s_cache_end(out, __fragments__, _env)\npass\n' % (self.value, self.render())
+    
+    def __repr__(self):
+        s = ['{{cache %s}}' % self.value]
+        for x in self.nodes:
+            s.append(repr(x))
+        s.append('{{end}}')
+        return ''.join(s)
+    
+    @staticmethod
+    def get_cache():
+        if not CacheNode.__cache__:
+            CacheNode.__cache__ = functions.get_cache()
+        return CacheNode.__cache__
+    
+    @staticmethod
+    def get_key(cache, name, args, tags=None):
+        s = repr(args)
+        if tags:
+            if isinstance(tags, (str, unicode)):
+                tags = [tags]
+            versions = [cache.get('template_tag:%s' % x, creator=lambda:uuid.uuid4().hex) for x in tags]
+            s += repr(versions)
+        return 'template_fragment:%s:%s' % (name, md5(s).hexdigest())
+    
+    @staticmethod
+    def begin_fragment(out, fragments, env, name, *args, **kwargs):
+        """
+        If the fragment is cached, write it to out, add its links to
+        __links__ and return False, otherwise begin to capture the output
+        and return True
+        """
+        cache = CacheNode.get_cache()
+        key = CacheNode.get_key(cache, name, args, kwargs.get('tags'))
+        v = cache.get(key, None)
+        if v is not None:
+            if isinstance(v, tuple):
+                text, links = v
+            else:
+                text, links = v, None
+            out.write(text, escape=False)
+            if links and '__links__' in env:
+                for k, x in links.items():
+                    env['__links__'][k].extend(x)
+            return False
+        links = env.get('__links__')
+        if links is not None:
+            links_pos = dict([(k, len(x)) for k, x in links.items()])
+        else:
+            links_pos = {}
+        fragments.append((key, len(out.buf), links_pos, kwargs.get('timeout')))
+        out.capturing += 1
+        return True
+    
+    @staticmethod
+    def end_fragment(out, fragments, env):
+        key, pos, links_pos, timeout = fragments.pop()
+        out.capturing -= 1
+        links = {}
+        for k, x in env.get('__links__', {}).items():
+            if len(x) > links_pos.get(k, 0):
+                links[k] = x[links_pos.get(k, 0):]
+        CacheNode.get_cache().set(key, (''.join(out.buf[pos:]), links), timeout)
+        
+def invalidate_cache_tags(*tags):
+    """
+    Invalidate the cached fragments of the tags
+    """
+    cache = CacheNode.get_cache()
+    for x in tags:
+        cache.set('template_tag:%s' % x, uuid.uuid4().hex)
+
+def register_marks():
+    """
+    The positions of head and links comments in literal text will be recorded
+    when rendering, so HtmlMerge needn't search them in the output
+    """
+    register_mark('head_begin', r_head_begin)
+    register_mark('head_end', r_head_end)
+    register_mark('toplinks', r_top)
+    register_mark('bottomlinks', r_bottom)
+    
 class HtmlMerge(object):
+    #(links, existlinks, static url binding):(toplinks, bottomlinks)
+    __cache__ = {}
+    __cache_size__ = 1000
+    
     def __init__(self, text, links, vars, env):
         self.text = text
         self.links = links
@@ -179,28 +295,29 @@ class HtmlMerge(object):
 #                bottom = (result['bottomlinks'] or '')
 #                return top + bottom + self.text
 
-        result = self.assemble(self._clean_collection([]))
-        #cal links first, if no toplinks or bottomlinks be found, then
-        #do nothing, otherwise find the head, and calculate the position
-        #of toplinks and bottomlinks
-        if result['toplinks'] or result['bottomlinks']:
-            links = []
-            b = r_head.search(self.text)
-            if b:
-                start, end = b.span()
-                head = b.group()
-                for v in r_links.findall(head):
-                    link = v[0] or v[1]
-                    links.append(link)
+        #if no toplinks or bottomlinks be found, then do nothing, otherwise 
+        #find the head, and calculate the position of toplinks and bottomlinks
+        if self.links.get('toplinks') or self.links.get('bottomlinks'):
+            marks = self.get_marks()
+            if marks:
+                head, top_start, bottom_start = marks
             else:
-                head = ''
-                start, end = 0, 0
-            result = self.assemble(self._clean_collection(links))
-            if result['toplinks'] or result['bottomlinks']:
-                top = result['toplinks'] or ''
-                bottom = result['bottomlinks'] or ''
-                top_start, bottom_start = self.cal_position(self.text, top, bottom,
-                    len(head), start)
+                b = r_head.search(self.text)
+                if b:
+                    start, end = b.span()
+                    head = b.group()
+                else:
+                    head = ''
+                    start, end = 0, 0
+            links = []
+            for v in r_links.findall(head):
+                link = v[0] or v[1]
+                links.append(link)
+            top, bottom = self.get_links(links)
+            if top or bottom:
+                if not marks:
+                    top_start, bottom_start = self.cal_position(self.text, top, bottom,
+                        len(head), start)
                 
                 if top and bottom:
                     if bottom_start < top_start:
@@ -213,6 +330,71 @@ class HtmlMerge(object):
         
         return self.text
     
+    def get_marks(self):
+        """
+        Return (head, toplinks position, bottomlinks position) according the
+        marks recorded in output, if there are no marks, or the text is 
+        changed by other callbacks, it'll return None
+        """
+        out = self.env.get('out')
+        if not isinstance(out, Out) or not out.marks or self.text is not out.value:
+            return None
+        head_start = out.get_position('head_begin')
+        head_end = out.get_position('head_end')
+        if head_start is None or head_end is None or head_end < head_start:
+            return None
+        top_start = out.get_position('toplinks')
+        if top_start is None:
+            top_start = head_start
+        bottom_start = out.get_position('bottomlinks')
+        if bottom_start is None:
+            bottom_start = head_end
+        return self.text[head_start:head_end], top_start, bottom_start
+    
+    def get_cache_key(self, existlinks):
+        """
+        Links which are template strings can't be cached, and static urls
+        depend on the binding of url adapter, so it's also in the key
+        """
+        from uliweb.core.SimpleFrame import get_url_adapter
+        from uliweb import settings
+        
+        key = []
+        for _type in ['toplinks', 'bottomlinks']:
+            t = []
+            for x in self.links.get(_type, []):
+                if isinstance(x, dict):
+                    x = x['value'], x['media']
+                elif '{{' in x and '}}' in x:
+                    return None
+                t.append(x)
+            key.append(tuple(t))
+        key.append(tuple(existlinks))
+        try:
+            adapter = get_url_adapter('static')
+        except Exception:
+            return None
+        key.append((adapter.server_name, adapter.script_name, adapter.url_scheme, 
+            settings.GLOBAL.STATIC_VER))
+        return tuple(key)
+        
+    def get_links(self, existlinks):
+        """
+        Return the html of (toplinks, bottomlinks), the result will be cached
+        """
+        key = self.get_cache_key(existlinks)
+        if key is not None:
+            v = HtmlMerge.__cache__.get(key)
+            if v is not None:
+                return v
+        result = self.assemble(self._clean_collection(existlinks))
+        v = result['toplinks'] or '', result['bottomlinks'] or ''
+        if key is not None:
+            if len(HtmlMerge.__cache__) >= HtmlMerge.__cache_size__:
+                HtmlMerge.__cache__.clear()
+            HtmlMerge.__cache__[key] = v
+        return v
+    
     def _clean_collection(self, existlinks):
         r = {'toplinks':[], 'bottomlinks':[]}
         links = {}
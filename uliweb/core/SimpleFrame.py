@@ -4,16 +4,22 @@
 ####################################################################
 
 import os, sys
+import cPickle as pickle
 import cgi
 import inspect
+import types
 from werkzeug import Request as OriginalRequest, Response as OriginalResponse
 from werkzeug import ClosingIterator, Local, LocalManager, BaseResponse
 from werkzeug.exceptions import HTTPException, NotFound
-from werkzeug.routing import Map
 
 import template
+import timing
+import manifest
+import watcher
+from matcher import IndexedMap
+from pathcache import path_cache
 from js import json_dumps
-from storage import Storage
+from storage import Storage, ChainStorage, VersionedStorage
 import dispatch
 from uliweb.utils.common import (pkg, log, import_attr, 
     myimport, wraps, norm_path, cache_get)
@@ -33,10 +39,13 @@ except:
 local = Local()
 __global__ = Global()
 local_manager = LocalManager([local])
-url_map = Map()
-static_views = []
+url_map = IndexedMap()
+static_views = set()
 use_urls = False
 url_adapters = {}
+url_endpoints = {}
+url_builds = {}
+URL_BUILD_CACHE_SIZE = 10000
 __app_dirs__ = {}
 __app_alias__ = {}
 
@@ -158,16 +167,39 @@ def GET(rule, **kw):
 
 def get_url_adapter(_domain_name):
     """
-    Fetch a domain url_adapter object, and bind it to according domain
+    Fetch a domain url_adapter object, and bind it to according domain.
+    The adapter of a fixed domain is created only once, others are bound to
+    current request environ and cached in the request object.
     """
     domain = application.domains.get(_domain_name, {})
     if domain.get('domain', ''):
-        adapter = url_map.bind(domain['host'], url_scheme=domain.get('scheme', 'http'))
+        adapter = url_adapters.get(_domain_name)
+        if adapter is None:
+            adapter = url_map.bind(domain['host'], url_scheme=domain.get('scheme', 'http'))
+            url_adapters[_domain_name] = adapter
     else:
-        adapter = url_map.bind_to_environ(request.environ)
+        req = local.request
+        adapter = getattr(req, 'url_adapter', None)
+        if adapter is None:
+            adapter = req.url_adapter = url_map.bind_to_environ(req.environ)
     return adapter
 
-def url_for(endpoint, **values):
+def get_endpoint(endpoint):
+    """
+    Convert the endpoint of url_for, it can be a function, a method, an
+    endpoint string or an url name, to the real endpoint string of url_map.
+    The result will be cached in url_endpoints.
+    """
+    try:
+        return url_endpoints[endpoint]
+    except KeyError:
+        pass
+    except TypeError:
+        return _get_endpoint(endpoint)
+    point = url_endpoints[endpoint] = _get_endpoint(endpoint)
+    return point
+    
+def _get_endpoint(endpoint):
     if inspect.isfunction(endpoint):
         point = endpoint.__module__ + '.' + endpoint.__name__
     elif inspect.ismethod(endpoint):
@@ -185,15 +217,41 @@ def url_for(endpoint, **values):
                     endpoint = v + endpoint[len(k):]
                     break
         point = endpoint
+    if point in rules.__url_names__:
+        point = rules.__url_names__[point]
+    return point
+
+def clear_url_cache():
+    url_endpoints.clear()
+    url_builds.clear()
+    url_adapters.clear()
+    
+def url_for(endpoint, **values):
+    point = get_endpoint(endpoint)
     _domain_name = values.pop('_domain_name', 'default')
     _external = values.pop('_external', False)
     domain = application.domains.get(_domain_name, {})
     if not _external:
         _external = domain.get('display', False)
-    if point in rules.__url_names__:
-        point = rules.__url_names__[point]
     adapter = get_url_adapter(_domain_name)
-    return adapter.build(point, values, force_external=_external)
+    
+    #the built url depends on the adapter binding, so add them to the key,
+    #the type of value is also in the key, because 1 and 1.0 will be
+    #converted to different urls
+    try:
+        key = (point, _external, adapter.server_name, adapter.script_name, 
+            adapter.subdomain, adapter.url_scheme, 
+            tuple(sorted([(k, type(v), v) for k, v in values.iteritems()])))
+        url = url_builds.get(key)
+    except TypeError:
+        #unhashable values
+        return adapter.build(point, values, force_external=_external)
+    if url is None:
+        url = adapter.build(point, values, force_external=_external)
+        if len(url_builds) >= URL_BUILD_CACHE_SIZE:
+            url_builds.clear()
+        url_builds[key] = url
+    return url
 
 def get_app_dir(app):
     """
@@ -347,9 +405,16 @@ class Loader(object):
     
 class Dispatcher(object):
     installed = False
+    endpoints = {}
+    view_hooks = {}
+    middleware_chains = {}
+    timing_collector = None
+    url_rules = []
+    template_env = None
+    watcher = None
     def __init__(self, apps_dir='apps', project_dir=None, include_apps=None, 
         start=True, default_settings=None, settings_file='settings.ini', 
-        local_settings_file='local_settings.ini'):
+        local_settings_file='local_settings.ini', manifest_file=None, lazy_views=False):
             
         __global__.application = self
         self.debug = False
@@ -357,10 +422,18 @@ class Dispatcher(object):
         self.default_settings = default_settings or {}
         self.settings_file = settings_file
         self.local_settings_file = local_settings_file
+        #manifest_file is used to cache the startup result, default is disabled
+        self.manifest_file = manifest_file
+        self.manifest = None
+        #if lazy_views is True and the manifest is valid, views modules will
+        #not be imported at startup, but at the first request of the endpoint
+        self.lazy_views = lazy_views
         if not Dispatcher.installed:
             self.init(project_dir, apps_dir)
             dispatch.call(self, 'startup_installed')
             self.init_urls()
+            if self.manifest_file and not self.manifest:
+                self.save_manifest()
             
         if start:
             dispatch.call(self, 'startup')
@@ -370,8 +443,13 @@ class Dispatcher(object):
             project_dir = norm_path(os.path.join(apps_dir, '..'))
         Dispatcher.project_dir = project_dir
         Dispatcher.apps_dir = norm_path(os.path.join(project_dir, 'apps'))
-        Dispatcher.apps = get_apps(self.apps_dir, self.include_apps, self.settings_file, self.local_settings_file)
-        Dispatcher.modules = self.collect_modules()
+        if self.manifest_file:
+            self.manifest = manifest.load(self.manifest_file, self.get_manifest_key())
+        if self.manifest:
+            self.load_manifest(self.manifest)
+        else:
+            Dispatcher.apps = get_apps(self.apps_dir, self.include_apps, self.settings_file, self.local_settings_file)
+            Dispatcher.modules = self.collect_modules()
         
         self.install_settings(self.modules['settings'])
         
@@ -395,28 +473,43 @@ class Dispatcher(object):
         rules.set_app_rules(dict(settings.get('URL', {})))
         
         Dispatcher.env = self._prepare_env()
-        Dispatcher.template_dirs = self.get_template_dirs()
+        if self.manifest:
+            Dispatcher.template_dirs = self.manifest['template_dirs']
+        else:
+            Dispatcher.template_dirs = self.get_template_dirs()
         Dispatcher.template_processors = {}
         self.install_template_processors()
         
         #begin to start apps
         self.install_apps()
         dispatch.call(self, 'after_init_apps')
+        #endpoints and view hooks of the former installation should be resolved again
+        Dispatcher.endpoints = {}
+        Dispatcher.view_hooks = {}
         #process views
-        self.install_views(self.modules['views'])
+        if not self.is_lazy_views():
+            self.install_views(self.modules['views'])
         #process exposes
         self.install_exposes()
         #process middlewares
         Dispatcher.middlewares = self.install_middlewares()
+        Dispatcher.middleware_chain = self.get_middleware_chain(self.middlewares)
+        #process request timing
+        Dispatcher.timing_collector = self.install_timing()
         
         self.debug = settings.GLOBAL.get('DEBUG', False)
+        #in debug mode, the cached paths will be checked by directory mtime
+        path_cache.check_mtime = self.debug
+        Dispatcher.watcher = self.install_watcher()
         dispatch.call(self, 'prepare_default_env', Dispatcher.env)
+        Dispatcher.view_env = self._prepare_view_env()
+        Dispatcher.template_env = None
         Dispatcher.default_template = pkg.resource_filename('uliweb.core', 'default.html')
         
         Dispatcher.installed = True
         
     def _prepare_env(self):
-        env = Storage({})
+        env = VersionedStorage({})
         env['url_for'] = url_for
         env['redirect'] = redirect
         env['Redirect'] = Redirect
@@ -426,6 +519,28 @@ class Dispatcher(object):
         env['json'] = json
         return env
     
+    def _prepare_view_env(self):
+        """
+        The base namespace of view functions, it'll be built only once. Per request
+        objects are LocalProxy objects, and self.env is chained but not copied.
+        The names of view modules are copied from it, and they'll be copied 
+        again by install_view_env when self.env is changed.
+        """
+        env = {}
+        env['application'] = __global__.application
+        env['request'] = request
+        env['response'] = response
+        env['url_for'] = url_for
+        env['redirect'] = redirect
+        env['Redirect'] = Redirect
+        env['error'] = error
+        env['settings'] = __global__.settings
+        env['json'] = json
+        env['function'] = function
+        env['functions'] = functions
+        env['json_dumps'] = json_dumps
+        return ChainStorage(env, self.env)
+    
     def set_log(self):
         import logging
         
@@ -508,8 +623,24 @@ class Dispatcher(object):
         
     def get_file(self, filename, dir='static'):
         """
-        get_file will search from apps directory
+        get_file will search from apps directory, the result will be cached
+        in path_cache
         """
+        if dir:
+            fname = os.path.join(dir, filename)
+        else:
+            fname = filename
+            
+        def watch_dirs():
+            d = [os.path.dirname(filename) or '.']
+            for p in self.apps:
+                d.append(os.path.dirname(pkg.resource_filename(p, fname)))
+            return d
+        
+        return path_cache.get(('file', filename, dir, tuple(self.apps)), 
+            lambda:self._get_file(filename, dir), watch_dirs)
+    
+    def _get_file(self, filename, dir='static'):
         if os.path.exists(filename):
             return filename
         dirs = self.apps
@@ -530,29 +661,71 @@ class Dispatcher(object):
         else:
             return template.template_file, {}
 
+    def get_template_compile(self, vars, dirs):
+        """
+        Return the compile function of template in debug mode
+        """
+        def _compile(code, filename, action, env, Loader=Loader):
+            env['__loader__'] = Loader(filename, vars, env, dirs, notest=True)
+            try:
+                return compile(code, filename, 'exec')
+            except:
+#                file('out.html', 'w').write(code)
+                raise
+        return _compile
+    
+    def get_template_env(self, env=None):
+        """
+        Return the namespace of template. The static part, view_env, is 
+        flattened into a dict, and per request env will be chained on top of 
+        it, so rendering only needs to copy the flattened dict. The flattened
+        dict will be rebuilt when self.env is changed.
+        """
+        env = env or self.get_view_env()
+        if isinstance(env, ChainStorage) and env.maps[-1] is self.view_env:
+            version = getattr(self.env, '_version', None)
+            template_env = Dispatcher.template_env
+            if template_env is None or template_env[0] != version:
+                template_env = (version, template.update_dict({}, self.view_env))
+                Dispatcher.template_env = template_env
+            env = ChainStorage(*(env.maps[:-1] + [template_env[1]]))
+        return env
+        
     def template(self, filename, vars=None, env=None, dirs=None, default_template=None):
         vars = vars or {}
         dirs = dirs or self.template_dirs
-        env = env or self.get_view_env()
+        env = self.get_template_env(env)
         
         func, kwargs = self.get_template_processor(filename)
         
         if self.debug:
-            def _compile(code, filename, action, env, Loader=Loader):
-                env['__loader__'] = Loader(filename, vars, env, dirs, notest=True)
-                try:
-                    return compile(code, filename, 'exec')
-                except:
-#                    file('out.html', 'w').write(code)
-                    raise
+            kwargs = dict(kwargs, compile=self.get_template_compile(vars, dirs))
             
-            return func(filename, vars, env, dirs, default_template, compile=_compile, **kwargs)
-        else:
+        with timing.get_timings()('template'):
             return func(filename, vars, env, dirs, default_template, **kwargs)
     
+    def stream_template(self, filename, vars=None, env=None, dirs=None, default_template=None, buffer_size=None):
+        """
+        Render the template in stream mode, it'll return an iterator of text
+        chunks. Template processors of other file types don't support stream 
+        mode, so the whole result will be returned as one chunk.
+        """
+        if os.path.splitext(filename)[1] in self.template_processors:
+            return [self.template(filename, vars, env, dirs, default_template)]
+        
+        vars = vars or {}
+        dirs = dirs or self.template_dirs
+        env = self.get_template_env(env)
+        
+        kwargs = {}
+        if self.debug:
+            kwargs['compile'] = self.get_template_compile(vars, dirs)
+        return template.stream_file(filename, vars, env, dirs, default_template, 
+            buffer_size=buffer_size, **kwargs)
+    
     def render_text(self, text, vars=None, env=None, dirs=None, default_template=None):
         vars = vars or {}
-        env = env or self.get_view_env()
+        env = self.get_template_env(env)
         dirs = dirs or self.template_dirs
         
         return template.template(text, vars, env, dirs, default_template)
@@ -560,6 +733,23 @@ class Dispatcher(object):
     def render(self, templatefile, vars, env=None, dirs=None, default_template=None, content_type='text/html', status=200):
         return Response(self.template(templatefile, vars, env, dirs, default_template=default_template), status=status, content_type=content_type)
     
+    def stream(self, templatefile, vars, env=None, dirs=None, default_template=None, content_type='text/html', status=200, buffer_size=None):
+        """
+        Return a streaming response, the template will be rendered while the
+        response is sent to the client. Note that the rendering happens after
+        all the middlewares' process_response are called, e.g. the transaction
+        of ORM middleware is committed and the session is saved, so the template
+        should not change the database or the session. Use render() when the 
+        template needs them.
+        
+        The response is streamed (response.is_streamed is True), so middlewares
+        which rewrite the body should skip it, e.g. CSRF middleware will not add
+        the token field to the forms, the template should add it itself.
+        """
+        return Response(self.stream_template(templatefile, vars, env, dirs, 
+            default_template=default_template, buffer_size=buffer_size), 
+            status=status, content_type=content_type, direct_passthrough=True)
+    
     def _page_not_found(self, description=None, **kwargs):
         description = 'The requested URL "{{=url}}" was not found on the server.'
         text = """<h1>Page Not Found</h1>
@@ -607,58 +797,89 @@ class Dispatcher(object):
             e.update(env)
         return e
     
-    def prepare_request(self, request, rule):
+    def resolve_endpoint(self, endpoint):
+        """
+        Resolve an endpoint to its module, handler, view class, appname and
+        __begin__/__end__ hooks. The result will be cached in self.endpoints.
+        """
         from uliweb.utils.common import safe_import
 
-        endpoint = rule.endpoint
-        #bind endpoint to request
-        request.rule = rule
-        #get handler
-        _klass = None
+        info = self.endpoints.get(endpoint)
+        if info is not None:
+            return info
+        
+        view_class = None
         if isinstance(endpoint, (str, unicode)):
             mod, handler = safe_import(endpoint)
             if inspect.ismethod(handler):
                 if not handler.im_self:    #instance method
-                    _klass = handler.im_class()
+                    view_class = handler.im_class
                 else:                       #class method
-                    _klass = handler.im_self()
-                #if _klass is class method, then the mod should be Class
+                    view_class = handler.im_self
+                #if handler is class method, then the mod should be Class
                 #so the real mod should be mod.__module__
                 mod = sys.modules[mod.__module__]
-                
-#            module, func = endpoint.rsplit('.', 1)
-#            #if the module contains a class name, then import the class
-#            #it set by expose()
-#            x, last = module.rsplit('.', 1)
-#            if last.startswith('views'):
-#                mod = __import__(module, {}, {}, [''])
-#                handler = getattr(mod, func)
-#            else:
-#                module = x
-#                mod = __import__(module, {}, {}, [''])
-#                _klass = getattr(mod, last)()
-#                handler = getattr(_klass, func)
         elif callable(endpoint):
             handler = endpoint
             mod = sys.modules[handler.__module__]
+        else:
+            raise UliwebError("Can't resolve the endpoint %r" % endpoint)
         
-        request.appname = ''
+        appname = ''
         for p in self.apps:
-            t = p + '.'
-            if handler.__module__.startswith(t):
-                request.appname = p
+            if handler.__module__.startswith(p + '.'):
+                appname = p
                 break
-        request.function = handler.__name__
-        if _klass:
-            request.view_class = _klass.__class__.__name__
-            handler = getattr(_klass, handler.__name__)
+            
+        info = Storage({'mod':mod, 'handler':handler, 'view_class':view_class,
+            'appname':appname, 'function':handler.__name__,
+            'hooks':self.get_view_hooks(mod, view_class)})
+        self.endpoints[endpoint] = info
+        return info
+    
+    def get_view_hooks(self, mod, view_class):
+        """
+        Find the __begin__ and __end__ hooks of a views module and a view class.
+        Each hook is (name, function), the function of view class hook is None,
+        because it should be bound to the view class instance when calling
+        """
+        key = (mod, view_class)
+        hooks = self.view_hooks.get(key)
+        if hooks is not None:
+            return hooks
+        
+        hooks = Storage({'mod_begin':None, 'mod_end':None, 'cls_begin':None, 'cls_end':None})
+        if mod is not None:
+            for name in ('begin', 'end'):
+                f = getattr(mod, '__%s__' % name, None)
+                if f is not None:
+                    hooks['mod_' + name] = (mod.__name__ + '.__%s__' % name, f)
+        if view_class is not None:
+            for name in ('begin', 'end'):
+                if hasattr(view_class, '__%s__' % name):
+                    hooks['cls_' + name] = ('.'.join([view_class.__module__, 
+                        view_class.__name__, '__%s__' % name]), None)
+        self.view_hooks[key] = hooks
+        return hooks
+    
+    def prepare_request(self, request, rule):
+        info = self.resolve_endpoint(rule.endpoint)
+        
+        #bind endpoint to request
+        request.rule = rule
+        request.appname = info.appname
+        request.function = info.function
+        if info.view_class:
+            _klass = info.view_class()
+            request.view_class = info.view_class.__name__
+            handler = getattr(_klass, info.function)
         else:
+            _klass = None
             request.view_class = None
-        return mod, _klass, handler
+            handler = info.handler
+        return info.mod, _klass, handler
     
     def call_view(self, mod, cls, handler, request, response=None, wrap_result=None, args=None, kwargs=None):
-        import types
-        
         #get env
         wrap = wrap_result or self.wrap_result
         env = self.get_view_env()
@@ -671,58 +892,51 @@ class Dispatcher(object):
         #twice, so I'll remember the function in cache, so that they'll not be invoke
         #twice
         
-        def _get_name(mod, name):
-            if isinstance(mod, types.ModuleType):
-                return mod.__name__ + '.' + name
-            else:
-                return cls.__module__ + '.' + cls.__class__.__name__ + '.' + name
-            
-        def _process_begin(mod):
-            name = '__begin__'
-            if hasattr(mod, name):
-                _name = _get_name(mod, name)
+        if cls is not None:
+            hooks = self.get_view_hooks(mod, cls.__class__)
+        else:
+            hooks = self.get_view_hooks(mod, None)
+        
+        def _process_begin(hook, obj=None):
+            if hook:
+                _name, f = hook
+                if obj is not None:
+                    f = obj.__begin__
                 if _name not in request._invokes['begin']:
                     request._invokes['begin'].append(_name)
-                    f = getattr(mod, name)
                     return self._call_function(f, request, response, env)
                     
-        def _prepare_end(mod):
-            name = '__end__'
-            if hasattr(mod, name):
-                _name = _get_name(mod, name)
+        def _prepare_end(hook):
+            if hook:
+                _name = hook[0]
                 if _name not in request._invokes['end']:
                     request._invokes['end'].append(_name)
                     return True
             
-        def _process_end(mod):
-            f = getattr(mod, '__end__')
-            return self._call_function(f, request, response, env)
-            
-                
         if not hasattr(request, '_invokes'):
             request._invokes = {'begin':[], 'end':[]}
             
-        result = _process_begin(mod)
+        result = _process_begin(hooks.mod_begin)
         if result is not None:
             return wrap(result, request, response, env)
         
-        result = _process_begin(cls)
+        result = _process_begin(hooks.cls_begin, cls)
         if result is not None:
             return wrap(result, request, response, env)
         
         #preprocess __end__
-        mod_end = _prepare_end(mod)
-        cls_end = _prepare_end(cls)
+        mod_end = _prepare_end(hooks.mod_end)
+        cls_end = _prepare_end(hooks.cls_end)
         
         result = self.call_handler(handler, request, response, env, wrap, args, kwargs)
 
         if mod_end:
-            result1 = _process_end(mod)
+            result1 = self._call_function(hooks.mod_end[1], request, response, env)
             if result1 is not None:
                 return wrap(result1, request, response, env)
         
         if cls_end:
-            result1 = _process_end(cls)
+            result1 = self._call_function(cls.__end__, request, response, env)
             if result1 is not None:
                 return wrap(result1, request, response, env)
 
@@ -769,27 +983,58 @@ class Dispatcher(object):
         #process before view call
         dispatch.call(self, 'prepare_view_env', local_env)
         
-        local_env['application'] = __global__.application
-        local_env['request'] = local.request
-        local_env['response'] = local.response
-        local_env['url_for'] = url_for
-        local_env['redirect'] = redirect
-        local_env['Redirect'] = Redirect
-        local_env['error'] = error
-        local_env['settings'] = __global__.settings
-        local_env['json'] = json
-        local_env['function'] = function
-        local_env['functions'] = functions
-        local_env['json_dumps'] = json_dumps
-        
-        return self.get_env(local_env)
-       
-    def _call_function(self, handler, request, response, env, args=None, kwargs=None):
+        #the fixed names can't be overridden by prepare_view_env
+        if local_env:
+            fixed = self.view_env.maps[0]
+            for k in local_env.keys():
+                if k in fixed:
+                    del local_env[k]
         
-        for k, v in env.iteritems():
-            handler.func_globals[k] = v
+        return ChainStorage(local_env, self.view_env)
+    
+    def install_view_env(self, g):
+        """
+        Inject the base view env into the globals of view module. It'll be 
+        injected only once, and if self.env is changed after the module is 
+        installed, it'll be injected again. Per request values are not 
+        injected, see bind_view_env.
+        """
+        version = getattr(self.env, '_version', None)
+        if '__uliweb_env__' not in g or g['__uliweb_env__'] != version:
+            for k, v in self.view_env.iteritems():
+                g[k] = v
+            g['env'] = view_env
+            g['__uliweb_env__'] = version
+        
+    def bind_view_env(self, handler, env):
+        """
+        Return a copy of handler whose globals are the globals of view module
+        and the names set by prepare_view_env, so the view will get the real
+        per request values, and the view module globals are not changed. 
+        Other functions in the view module can get them through `env`.
+        """
+        if isinstance(env, ChainStorage):
+            local_env = env.maps[0]
+        else:
+            local_env = env
+        func = getattr(handler, 'im_func', handler)
+        if not local_env or not isinstance(func, types.FunctionType):
+            return handler
         
-        handler.func_globals['env'] = env
+        g = func.func_globals.copy()
+        g.update(local_env)
+        g['env'] = env
+        f = types.FunctionType(func.func_code, g, func.func_name, 
+            func.func_defaults, func.func_closure)
+        f.__dict__ = func.__dict__
+        if func is not handler:
+            f = types.MethodType(f, handler.im_self, handler.im_class)
+        return f
+       
+    def _call_function(self, handler, request, response, env, args=None, kwargs=None):
+        local.view_env = env
+        self.install_view_env(handler.func_globals)
+        handler = self.bind_view_env(handler, env)
         
         args = args or ()
         kwargs = kwargs or {}
@@ -803,9 +1048,55 @@ class Dispatcher(object):
         result = self._call_function(handler, request, response, env, args, kwargs)
         return wrap(result, request, response, env)
             
+    def get_manifest_key(self):
+        from uliweb import version
+        
+        return (version, os.path.abspath(self.project_dir), os.path.abspath(self.apps_dir), tuple(self.include_apps),
+            self.settings_file, self.local_settings_file)
+    
+    def load_manifest(self, data):
+        Dispatcher.apps = data['apps']
+        Dispatcher.modules = data['modules']
+        __app_dirs__.update(data['app_dirs'])
+        __app_alias__.update(data['app_alias'])
+        
+    def save_manifest(self):
+        """
+        Save apps, settings, views, url rules and template dirs to manifest
+        file, all the files which will affect them will be tracked, so if any
+        of them is changed, the manifest will be rebuilt at next start
+        """
+        files = [self.apps_dir] + self.modules['settings'] + self.modules['view_files']
+        for f in [self.settings_file, self.local_settings_file]:
+            files.append(os.path.join(self.apps_dir, f))
+        for p in self.apps:
+            path = get_app_dir(p)
+            files.extend([path, os.path.join(path, 'settings.ini'), 
+                os.path.join(path, 'config.ini'), os.path.join(path, 'views'),
+                os.path.join(path, 'templates')])
+        files.extend([os.path.join(self.project_dir, x) for x in settings.GLOBAL.TEMPLATE_DIRS or []])
+        
+        data = {
+            'apps':self.apps,
+            'modules':self.modules,
+            'app_dirs':dict([(k, v and os.path.abspath(v)) for k, v in __app_dirs__.items()]),
+            'app_alias':__app_alias__,
+            'settings':self._settings_snapshot,
+            'template_dirs':[os.path.abspath(x) for x in self.template_dirs],
+            'rules':self.url_rules,
+            'url_names':rules.__url_names__,
+        }
+        try:
+            manifest.save(self.manifest_file, self.get_manifest_key(), data, 
+                set([os.path.abspath(x) for x in files]))
+        except Exception, e:
+            log.error("Can't save manifest file %s" % self.manifest_file)
+            log.exception(e)
+            
     def collect_modules(self, check_view=True):
         modules = {}
         views = set()
+        view_files = []
         settings = []
 
         inifile = pkg.resource_filename('uliweb.core', 'default_settings.ini')
@@ -827,6 +1118,7 @@ class Dispatcher(object):
                         views.add('.'.join([appname, subfolder, fname]))
                     else:
                         views.add('.'.join([appname, fname]))
+                    view_files.append(os.path.join(views_path, f))
 
         for p in self.apps:
             path = get_app_dir(p)
@@ -852,6 +1144,7 @@ class Dispatcher(object):
             settings.append(local_set_ini)
         
         modules['views'] = list(views)
+        modules['view_files'] = view_files
         modules['settings'] = settings
         return modules
     
@@ -864,16 +1157,44 @@ class Dispatcher(object):
          
     def init_urls(self):
         #initialize urls
-        for v in rules.merge_rules():
+        clear_url_cache()
+        if self.manifest:
+            rules.__url_names__.update(self.manifest['url_names'])
+            Dispatcher.url_rules = self.manifest['rules']
+        else:
+            Dispatcher.url_rules = [(a, e, u, kw.copy()) for a, e, u, kw in rules.merge_rules()]
+        for v in self.url_rules:
             appname, endpoint, url, kw = v
+            kw = kw.copy()
             static = kw.pop('static', None)
             if static:
-                static_views.append(endpoint)
+                static_views.add(endpoint)
             try:
                 rules.add_rule(url_map, url, endpoint, **kw)
             except:
                 log.error("Wrong url url=%s, endpoint=%s" % (url, endpoint))
                 raise
+        
+        if not self.is_lazy_views():
+            self.install_endpoints()
+    
+    def is_lazy_views(self):
+        """
+        Views can be imported lazily only when url rules are loaded from manifest
+        """
+        return bool(self.lazy_views and self.manifest)
+        
+    def install_endpoints(self):
+        """
+        Resolve all the endpoints of url_map at startup, so that dispatching
+        a request only needs a dict lookup
+        """
+        for r in url_map.iter_rules():
+            try:
+                self.resolve_endpoint(r.endpoint)
+            except Exception, e:
+                #the error will be raised again when the endpoint is requested
+                log.debug("Can't resolve endpoint %r: %s" % (r.endpoint, e))
     
     def install_apps(self):
         for p in self.apps:
@@ -891,8 +1212,20 @@ class Dispatcher(object):
         
     def install_settings(self, s):
 #        settings = pyini.Ini()
-        for v in s:
-            settings.read(v)
+        if self.manifest:
+            __global__.settings = self.manifest['settings']
+        else:
+            for v in s:
+                settings.read(v)
+            if self.manifest_file:
+                #keep the settings before updating, because default_settings
+                #and startup hooks may put unpicklable objects into it
+                try:
+                    self._settings_snapshot = pickle.loads(pickle.dumps(__global__.settings, pickle.HIGHEST_PROTOCOL))
+                except Exception, e:
+                    log.error("Settings can't be saved to manifest")
+                    log.exception(e)
+                    self.manifest_file = None
         settings.update(self.default_settings)
         
         #process FILESYSTEM_ENCODING
@@ -966,6 +1299,8 @@ class Dispatcher(object):
                 raise UliwebError('EXPOSES definition [%s=%r] is not right' % (name, args))
        
     def install_middlewares(self):
+        #the cached chains were created with the former settings
+        Dispatcher.middleware_chains = {}
         return self.sort_middlewares(settings.get('MIDDLEWARES', {}).values())
     
     def sort_middlewares(self, middlewares):
@@ -997,6 +1332,114 @@ class Dispatcher(object):
             
         return [x[1] for x in m]
     
+    def install_timing(self):
+        if not settings.get_var('TIMING/ENABLE', False):
+            return None
+        cls = import_attr(settings.get_var('TIMING/COLLECTOR', 'uliweb.core.timing.Collector'))
+        return cls(self, settings)
+    
+    def install_watcher(self):
+        """
+        Watch template dirs, static dirs and settings files if WATCHER/ENABLE
+        is True. The watcher will be started by start_watcher() when the first
+        request is processed in each process.
+        """
+        if self.watcher:
+            self.watcher.stop()
+        if not settings.get_var('WATCHER/ENABLE', False):
+            template.set_options(check_files=True)
+            return None
+        
+        w = watcher.Watcher(settings.get_var('WATCHER/INTERVAL', 1))
+        for p in self.template_dirs:
+            w.watch(p)
+        for p in self.apps:
+            path = os.path.join(get_app_dir(p), 'static')
+            if os.path.exists(path):
+                w.watch(path)
+        static_folder = settings.get_var('STATICFILES/STATIC_FOLDER')
+        if static_folder and os.path.exists(static_folder):
+            w.watch(static_folder)
+        for p in self.modules['settings']:
+            w.watch(p)
+        self._settings_values = self.read_settings()
+        w.add_callback(self.files_changed)
+        return w
+    
+    def start_watcher(self):
+        """
+        Start the watcher if it's not running in current process, e.g. the
+        process is forked by a preforking server. Cached templates and paths 
+        will not be checked when processing requests only after the watcher 
+        is running, because the watcher will invalidate them.
+        """
+        w = self.watcher
+        if not w.is_running():
+            w.start()
+            path_cache.check_mtime = False
+            template.set_options(check_files=False)
+    
+    def files_changed(self, changed):
+        """
+        Invoked by watcher when watched files are changed
+        """
+        template.clear_cache()
+        path_cache.clear()
+        if [x for x in changed if x.endswith('.ini')]:
+            self.reload_settings()
+            
+    def read_settings(self):
+        s = pyini.Ini()
+        for v in self.modules['settings']:
+            s.read(v)
+        s.update(self.default_settings)
+        return s
+    
+    def reload_settings(self):
+        """
+        Read settings files again, and update the changed values of current
+        settings in place, so the code which reads settings at runtime will
+        see the changes. The values changed by startup code will be kept if
+        they are not changed in files. Changed keys will be passed to
+        `settings_changed` dispatch topic.
+        """
+        old, new = self._settings_values, self.read_settings()
+        changed = []
+        for name, section in new.items():
+            old_section = old.get(name, {})
+            for k, v in section.items():
+                if k not in old_section or old_section[k] != v:
+                    settings.add(name).__setitem__(k, v, True)
+                    changed.append('%s/%s' % (name, k))
+        self._settings_values = new
+        if changed:
+            dispatch.call(self, 'settings_changed', changed)
+        return changed
+    
+    def get_middleware_chain(self, middlewares):
+        """
+        Create middleware instances only once for the sorted middleware classes, 
+        and collect process_request, process_response and process_exception
+        methods in calling order
+        """
+        key = tuple(middlewares)
+        chain = self.middleware_chains.get(key)
+        if chain is not None:
+            return chain
+        
+        instances = [cls(self, settings) for cls in middlewares]
+        chain = Storage({'request':[], 'response':[], 'exception':[]})
+        for ins in instances:
+            if hasattr(ins, 'process_request'):
+                chain.request.append(ins.process_request)
+        for ins in reversed(instances):
+            if hasattr(ins, 'process_response'):
+                chain.response.append(ins.process_response)
+            if hasattr(ins, 'process_exception'):
+                chain.exception.append(ins.process_exception)
+        self.middleware_chains[key] = chain
+        return chain
+    
     def get_template_dirs(self):
         """
         Get templates directory from apps, but in reversed order, so the same named template
@@ -1043,59 +1486,63 @@ class Dispatcher(object):
         return self._open(environ, pre_call=pre_call, post_call=post_call, middlewares=m)
         
     def _open(self, environ, pre_call=None, post_call=None, middlewares=None):
+        if self.watcher:
+            self.start_watcher()
+            
         if middlewares is None:
-            middlewares = self.middlewares
+            chain = self.middleware_chain
+        else:
+            chain = self.get_middleware_chain(middlewares)
             
         local.request = req = Request(environ)
         local.response = res = Response(content_type='text/html')
         
-        url_adapter = get_url_adapter('default')
+        if self.timing_collector:
+            timings = timing.Timings()
+        else:
+            timings = timing.null_timings
+        timing.set_timings(timings)
+        
+        response = None
         try:
-            rule, values = url_adapter.match(return_rule=True)
+            url_adapter = get_url_adapter('default')
+            with timings('match'):
+                rule, values = url_adapter.match(return_rule=True)
             mod, handler_cls, handler = self.prepare_request(req, rule)
             
             #process static
             if rule.endpoint in static_views:
-                response = self.call_view(mod, handler_cls, handler, req, res, kwargs=values)
+                with timings('view'):
+                    response = self.call_view(mod, handler_cls, handler, req, res, kwargs=values)
             else:
                 response = None
-                _clses = {}
-                _inss = {}
-                for cls in middlewares:
-                    if hasattr(cls, 'process_request'):
-                        ins = cls(self, settings)
-                        _inss[cls] = ins
-                        response = ins.process_request(req)
-                        if response is not None:
-                            break
+                for process_request in chain.request:
+                    with timings(process_request):
+                        response = process_request(req)
+                    if response is not None:
+                        break
                 
                 if response is None:
                     try:
                         if pre_call:
                             response = pre_call(req)
                         if response is None:
-                            response = self.call_view(mod, handler_cls, handler, req, res, kwargs=values)
+                            with timings('view'):
+                                response = self.call_view(mod, handler_cls, handler, req, res, kwargs=values)
                         if post_call:
                             response = post_call(req, response)
                     except RedirectException, e:
                         raise
                     except Exception, e:
-                        for cls in reversed(middlewares):
-                            if hasattr(cls, 'process_exception'):
-                                ins = _inss.get(cls)
-                                if not ins:
-                                    ins = cls(self, settings)
-                                response = ins.process_exception(req, e)
-                                if response:
-                                    break
+                        for process_exception in chain.exception:
+                            response = process_exception(req, e)
+                            if response:
+                                break
                         raise
                     
-                for cls in reversed(middlewares):
-                    if hasattr(cls, 'process_response'):
-                        ins = _inss.get(cls)
-                        if not ins:
-                            ins = cls(self, settings)
-                        response = ins.process_response(req, response)
+                for process_response in chain.response:
+                    with timings(process_response):
+                        response = process_response(req, response)
                 
             #endif
             
@@ -1113,6 +1560,16 @@ class Dispatcher(object):
             else:
 #                log.exception(e)
                 raise
+        finally:
+            #timings should be cleared even if an exception is raised, otherwise
+            #it'll be leaked into the next request of this thread
+            if timings:
+                timings.stop()
+                try:
+                    response = self.timing_collector.collect(req, response, timings)
+                    dispatch.call(self, 'request_timing', req, response, timings)
+                finally:
+                    timing.set_timings(None)
         return response
     
     def handler(self):
@@ -1162,5 +1619,6 @@ class DispatcherHandler(object):
 
 response = LocalProxy(local, 'response', Response)
 request = LocalProxy(local, 'request', Request)
+view_env = LocalProxy(local, 'view_env', ChainStorage)
 settings = LocalProxy(__global__, 'settings', pyini.Ini)
 application = LocalProxy(__global__, 'application', Dispatcher)
@@ -0,0 +1,95 @@
+####################################################################
+# Author: Limodou@gmail.com
+# License: BSD
+####################################################################
+
+"""
+Startup manifest of Dispatcher. It's a pickled snapshot of apps list, merged
+settings, views modules, url rules and template directories, so that a warm
+start can skip apps discovery and settings parsing.
+
+Each tracked file or directory is recorded with its mtime and content hash
+(for directory it's the hash of the sorted file names), the manifest will be
+used only when all of them are not changed.
+"""
+
+import os
+import cPickle as pickle
+from hashlib import md5
+
+VERSION = 1
+
+def get_signature(path):
+    """
+    Return (mtime, hash) of a file or directory, or None if it's not existed
+    """
+    if not os.path.exists(path):
+        return None
+    return os.path.getmtime(path), get_hash(path)
+
+def get_hash(path):
+    if os.path.isdir(path):
+        return md5('\n'.join(sorted(os.listdir(path)))).hexdigest()
+    f = open(path, 'rb')
+    try:
+        return md5(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def is_changed(path, signature):
+    if not os.path.exists(path):
+        return signature is not None
+    if signature is None:
+        return True
+    mtime, hash = signature
+    if os.path.getmtime(path) == mtime:
+        return False
+    #the file may be only touched, so check the content
+    return get_hash(path) != hash
+
+def load(filename, key):
+    """
+    Load the manifest, if it's not existed, or it's created with different
+    key, or tracked files are changed, it'll return None
+    """
+    if not filename or not os.path.exists(filename):
+        return None
+    try:
+        f = open(filename, 'rb')
+        try:
+            data = pickle.load(f)
+        finally:
+            f.close()
+    except Exception:
+        return None
+    if data.get('version') != VERSION or data.get('key') != key:
+        return None
+    for path, signature in data['files'].iteritems():
+        if is_changed(path, signature):
+            return None
+    return data
+
+def save(filename, key, data, files):
+    """
+    Save manifest data, files are the paths which should be tracked. The file
+    will be written to a temp file first and then renamed, so other processes
+    will never read a half written manifest.
+    """
+    d = dict(data)
+    d['version'] = VERSION
+    d['key'] = key
+    d['files'] = dict([(x, get_signature(x)) for x in files])
+    text = pickle.dumps(d, pickle.HIGHEST_PROTOCOL)
+
+    path = os.path.dirname(filename)
+    if path and not os.path.exists(path):
+        os.makedirs(path)
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write(text)
+    finally:
+        f.close()
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp, filename)
@@ -0,0 +1,199 @@
+####################################################################
+# Author: Limodou@gmail.com
+# License: BSD
+####################################################################
+
+"""
+Indexed url map. werkzeug MapAdapter.match tries every rule regex in order,
+IndexedMap will build an index when rules are changed:
+
+* rules without converters are indexed by the whole path
+* rules whose first path segment is literal are indexed by the segment
+* other rules will be tried for every path
+
+so only the rules which may match the path will be tried, and they are still
+tried in the werkzeug sorted order, so the precedence is not changed.
+"""
+
+import threading
+from urlparse import urljoin
+from werkzeug.routing import (Map, MapAdapter, RequestSlash, RequestRedirect,
+    RequestAliasRedirect, _simple_rule_re)
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+
+__all__ = ['IndexedMap', 'IndexedMapAdapter']
+
+def get_rule_key(rule):
+    """
+    Return ('path', [paths]) for a rule without converters in path,
+    ('segment', name) for a rule whose first path segment is literal, or
+    (None, None) if the rule should be tried for every path
+    """
+    trace = rule._trace
+    i = trace.index((False, '|'))
+    trace = trace[i+1:]
+    if not rule.is_leaf:
+        #the last '/' of branch url is processed by __suffix__ group
+        trace = trace[:-1]
+
+    prefix = []
+    static = True
+    for is_dynamic, data in trace:
+        if is_dynamic:
+            static = False
+            break
+        prefix.append(data)
+    try:
+        prefix = unicode(''.join(prefix))
+    except UnicodeDecodeError:
+        return None, None
+
+    if static:
+        if not rule.is_leaf or not rule.strict_slashes:
+            return 'path', [prefix or u'/', prefix + u'/']
+        return 'path', [prefix]
+    pos = prefix.find(u'/', 1)
+    if pos > -1:
+        return 'segment', prefix[1:pos]
+    return None, None
+
+class IndexedMap(Map):
+    def __init__(self, *args, **kwargs):
+        self._index = None
+        self._index_lock = threading.Lock()
+        Map.__init__(self, *args, **kwargs)
+
+    def update(self):
+        """
+        The same as werkzeug Map.update, but the index will be built too. The
+        index is published with one assignment, and _remap will be cleared
+        after that, so other threads will never see a half built index.
+        """
+        if not self._remap:
+            return
+        with self._index_lock:
+            if self._remap:
+                self._rules.sort(key=lambda x: x.match_compare_key())
+                for rules in self._rules_by_endpoint.itervalues():
+                    rules.sort(key=lambda x: x.build_compare_key())
+                self._index = self.build_index()
+                self._remap = False
+
+    def build_index(self):
+        """
+        Return (path_index, segment_index, wildcard_rules) of current rules
+        """
+        paths = {}
+        segments = {}
+        wildcards = []
+        for i, rule in enumerate(self._rules):
+            if rule.build_only:
+                continue
+            kind, key = get_rule_key(rule)
+            if kind == 'path':
+                for k in set(key):
+                    paths.setdefault(k, []).append((i, rule))
+            elif kind == 'segment':
+                segments.setdefault(key, []).append((i, rule))
+            else:
+                wildcards.append((i, rule))
+
+        #merge the candidates in rules order
+        segment_index = {}
+        for k, v in segments.iteritems():
+            segment_index[k] = sorted(v + wildcards)
+        path_index = {}
+        for k, v in paths.iteritems():
+            segment = k[1:].split(u'/', 1)[0]
+            path_index[k] = sorted(v + segment_index.get(segment, wildcards))
+        return path_index, segment_index, wildcards
+
+    def get_candidates(self, path_info):
+        """
+        Return the rules which may match the path_info, path_info should
+        be started with '/'
+        """
+        path_index, segment_index, wildcards = self._index
+        rules = path_index.get(path_info)
+        if rules is None:
+            segment = path_info[1:].split(u'/', 1)[0]
+            rules = segment_index.get(segment, wildcards)
+        return rules
+
+    def _make_adapter(self, a):
+        return IndexedMapAdapter(self, a.server_name, a.script_name, a.subdomain,
+            a.url_scheme, a.path_info, a.default_method, a.query_args)
+
+    def bind(self, *args, **kwargs):
+        return self._make_adapter(Map.bind(self, *args, **kwargs))
+
+    def bind_to_environ(self, *args, **kwargs):
+        return self._make_adapter(Map.bind_to_environ(self, *args, **kwargs))
+
+class IndexedMapAdapter(MapAdapter):
+    def match(self, path_info=None, method=None, return_rule=False,
+              query_args=None):
+        """
+        The same as werkzeug MapAdapter.match, but only the candidate rules
+        will be tried
+        """
+        self.map.update()
+        if path_info is None:
+            path_info = self.path_info
+        if not isinstance(path_info, unicode):
+            path_info = path_info.decode(self.map.charset,
+                                         self.map.encoding_errors)
+        if query_args is None:
+            query_args = self.query_args
+        method = (method or self.default_method).upper()
+
+        p = u'/' + path_info.lstrip('/')
+        path = u'%s|%s' % (self.map.host_matching and self.server_name or
+                            self.subdomain, p)
+
+        have_match_for = set()
+        for i, rule in self.map.get_candidates(p):
+            try:
+                rv = rule.match(path)
+            except RequestSlash:
+                raise RequestRedirect(self.make_redirect_url(
+                    path_info + '/', query_args))
+            except RequestAliasRedirect, e:
+                raise RequestRedirect(self.make_alias_redirect_url(
+                    path, rule.endpoint, e.matched_values, method, query_args))
+            if rv is None:
+                continue
+            if rule.methods is not None and method not in rule.methods:
+                have_match_for.update(rule.methods)
+                continue
+
+            if self.map.redirect_defaults:
+                redirect_url = self.get_default_redirect(rule, method, rv,
+                                                         query_args)
+                if redirect_url is not None:
+                    raise RequestRedirect(redirect_url)
+
+            if rule.redirect_to is not None:
+                if isinstance(rule.redirect_to, basestring):
+                    def _handle_match(match):
+                        value = rv[match.group(1)]
+                        return rule._converters[match.group(1)].to_url(value)
+                    redirect_url = _simple_rule_re.sub(_handle_match,
+                                                       rule.redirect_to)
+                else:
+                    redirect_url = rule.redirect_to(self, **rv)
+                raise RequestRedirect(str(urljoin('%s://%s%s%s' % (
+                    self.url_scheme,
+                    self.subdomain and self.subdomain + '.' or '',
+                    self.server_name,
+                    self.script_name
+                ), redirect_url)))
+
+            if return_rule:
+                return rule, rv
+            else:
+                return rule.endpoint, rv
+
+        if have_match_for:
+            raise MethodNotAllowed(valid_methods=list(have_match_for))
+        raise NotFound()
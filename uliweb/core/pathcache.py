@@ -0,0 +1,65 @@
+####################################################################
+# Author: Limodou@gmail.com
+# License: BSD
+####################################################################
+
+"""
+Resolved path cache. Template and static files lookups will test the file
+in each search directory, path_cache keeps the resolved result (or None if
+not found) of a logical name and search directories, so the same lookup
+will not stat the file system again.
+
+In debug mode, check_mtime will be True, and the mtimes of the directories
+where the file may be will be checked, if any of them is changed, the path
+will be resolved again. Otherwise the result is kept until clear() is
+called.
+"""
+
+import os
+
+__all__ = ['PathCache', 'path_cache']
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+class PathCache(object):
+    def __init__(self, check_mtime=False, max_size=10000):
+        self.check_mtime = check_mtime
+        self.max_size = max_size
+        self.cache = {}
+
+    def get(self, key, resolve, watch_dirs=None):
+        """
+        Return cached path of key, if it's not cached, resolve() will be
+        called to get the path. watch_dirs() should return the directories
+        which will be changed when the result of resolve() is changed, it's
+        only used when check_mtime is True.
+        """
+        v = self.cache.get(key)
+        if v is not None:
+            path, stamps = v
+            if not self.check_mtime or not watch_dirs:
+                return path
+            if stamps is not None and stamps == self.get_stamps(watch_dirs()):
+                return path
+
+        if self.check_mtime and watch_dirs:
+            stamps = self.get_stamps(watch_dirs())
+        else:
+            stamps = None
+        path = resolve()
+        if len(self.cache) >= self.max_size:
+            self.cache.clear()
+        self.cache[key] = path, stamps
+        return path
+
+    def get_stamps(self, dirs):
+        return [get_mtime(x) for x in dirs]
+
+    def clear(self):
+        self.cache.clear()
+
+path_cache = PathCache()
@@ -36,3 +36,129 @@ class Storage(dict):
         return dict(self)
     def __setstate__(self,value):
         for k,v in value.items(): self[k]=v
+
+class ChainStorage(object):
+    """
+    A ChainStorage object looks up keys in a chain of mappings, and only the
+    first mapping will be changed, so the others will never be copied. It
+    supports `obj.foo` just like Storage.
+    
+        >>> base = {'a':1, 'b':2}
+        >>> o = ChainStorage({'b':3}, base)
+        >>> o.a, o['b'], o.c
+        (1, 3, None)
+        >>> o.c = 4
+        >>> sorted(o.items())
+        [('a', 1), ('b', 3), ('c', 4)]
+        >>> base
+        {'a': 1, 'b': 2}
+    
+    """
+    def __init__(self, *maps):
+        object.__setattr__(self, 'maps', list(maps) or [{}])
+        
+    def __getitem__(self, key):
+        for m in self.maps:
+            if key in m:
+                return m[key]
+        raise KeyError(key)
+    def __setitem__(self, key, value):
+        self.maps[0][key] = value
+    def __delitem__(self, key):
+        del self.maps[0][key]
+    def __contains__(self, key):
+        for m in self.maps:
+            if key in m:
+                return True
+        return False
+    has_key = __contains__
+    def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)
+        try: return self[key]
+        except KeyError, k: return None
+    def __setattr__(self, key, value):
+        self[key] = value
+    def __delattr__(self, key):
+        try: del self[key]
+        except KeyError, k: raise AttributeError, k
+    def get(self, key, default=None):
+        for m in self.maps:
+            if key in m:
+                return m[key]
+        return default
+    def keys(self):
+        s = set()
+        for m in self.maps:
+            s.update(m.keys())
+        return list(s)
+    def __iter__(self):
+        return iter(self.keys())
+    iterkeys = __iter__
+    def __len__(self):
+        return len(self.keys())
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+    def iteritems(self):
+        for k in self.keys():
+            yield k, self[k]
+    def values(self):
+        return [self[k] for k in self.keys()]
+    def update(self, *args, **kwargs):
+        self.maps[0].update(*args, **kwargs)
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+            return default
+        return self[key]
+    def pop(self, key, *args):
+        return self.maps[0].pop(key, *args)
+    def copy(self):
+        return Storage(self.items())
+    def new_child(self, m=None):
+        return ChainStorage(*([m if m is not None else {}] + self.maps))
+    def __repr__(self):
+        return '<ChainStorage ' + repr(self.maps) + '>'
+
+class VersionedStorage(Storage):
+    """
+    A Storage object which counts its changes, so the users who copy its
+    values can know if the copies are out of date.
+    
+        >>> o = VersionedStorage(a=1)
+        >>> v = o._version
+        >>> o.b = 2
+        >>> o._version == v + 1
+        True
+        >>> o.update(c=3)
+        >>> o._version == v + 2
+        True
+    
+    """
+    _version = 0
+    def _changed(self):
+        self.__dict__['_version'] = self._version + 1
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._changed()
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed()
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+    def pop(self, key, *args):
+        self._changed()
+        return dict.pop(self, key, *args)
+    def popitem(self):
+        self._changed()
+        return dict.popitem(self)
+    def clear(self):
+        dict.clear(self)
+        self._changed()
+    def __repr__(self):     
+        return '<VersionedStorage ' + dict.__repr__(self) + '>'
@@ -5,14 +5,41 @@ import re
 import os
 import StringIO
 import cgi
+import imp
+import marshal
+import struct
+import threading
+import symtable
+import tempfile
+import types
+import warnings
+import ast
+from collections import OrderedDict
+from pathcache import path_cache
 
 __templates_temp_dir__ = 'tmp/templates_temp'
-__options__ = {'use_temp_dir':False}
+#check_files: if check the mtimes of template files when the compiled code is
+#found in memory, it can be disabled if the files are watched by others
+__options__ = {'use_temp_dir':False, 'cache_size':500, 'buffer_size':8192, 
+    'check_files':True}
 __nodes__ = {}   #user defined nodes
+#name:regex, when literal text matches the regex, out.mark(name) will be called
+#at the end of the matched text, so callbacks can get the position from
+#out without searching the output
+__marks__ = {}
+
+#format version of the compiled template file in temp dir, it should be
+#increased when the format is changed
+TEMP_VERSION = 1
 
 BEGIN_TAG = '{{'
 END_TAG = '}}'
 
+#block boundary mark in parsed code, it's a constant expression statement, it's
+#only kept in the code which will be converted to stream code
+BLOCK_MARK = '__block__'
+STREAM_FUNC = '_stream_'
+
 class TemplateException(Exception): pass
 class ContextPopException(TemplateException):
     "pop() has been called more times than push()"
@@ -29,9 +56,73 @@ def use_tempdir(dir=''):
 
 def set_options(**options):
     """
-    default use_temp_dir=False
+    default use_temp_dir=False, cache_size=500, buffer_size=8192, check_files=True
     """
     __options__.update(options)
+    
+class LRUCache(object):
+    """
+    A simple thread safe LRU cache, size is read from size_func every time,
+    so it can be changed at runtime, 0 means disabled
+    """
+    def __init__(self, size_func):
+        self.size_func = size_func
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+        
+    def set(self, key, value):
+        size = self.size_func()
+        if size <= 0:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > size:
+                self.data.popitem(last=False)
+        
+    def remove(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+        
+    def __len__(self):
+        return len(self.data)
+    
+#compiled code objects of template files, the value is (code, [(file, mtime),...])
+__compiled_templates__ = LRUCache(lambda:__options__['cache_size'])
+
+def get_files_mtime(files):
+    try:
+        return [(x, os.path.getmtime(x)) for x in files]
+    except OSError:
+        return None
+
+def is_files_changed(files):
+    try:
+        for x, mtime in files:
+            if os.path.getmtime(x) != mtime:
+                return True
+    except OSError:
+        return True
+    return False
+
+def clear_cache():
+    """
+    Clear compiled templates cache
+    """
+    __compiled_templates__.clear()
 
 def get_temp_template(filename):
     if __options__['use_temp_dir']:
@@ -39,14 +130,177 @@ def get_temp_template(filename):
         filename = filename.replace('\\', '_')
         filename = filename.replace('/', '_')
         f, ext = os.path.splitext(filename)
-        filename = f + '.py'
+        filename = f + '.pyc'
         return os.path.normcase(os.path.join(__templates_temp_dir__, filename))
     return filename
 
+def get_temp_header():
+    return 'ULTP' + struct.pack('<I', TEMP_VERSION) + imp.get_magic()
+
+def load_temp_template(filename):
+    """
+    Load compiled template file, the format is:
+    
+        header + marshal.dumps((files, text, code))
+        
+    files is [(filename, mtime),...] of the template and its depend files,
+    if the header is not matched or any of the files is changed, it'll
+    return None, otherwise return (files, text, code)
+    """
+    if not os.path.exists(filename):
+        return None
+    header = get_temp_header()
+    f = open(filename, 'rb')
+    try:
+        if f.read(len(header)) != header:
+            return None
+        try:
+            files, text, code = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+    if is_files_changed(files):
+        return None
+    return files, text, code
+
+def save_temp_template(filename, files, text, code):
+    """
+    Save compiled template file, it'll be written to a unique temp file first 
+    and then renamed, so other processes and threads will never read a half 
+    written file
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(filename)+'.', 
+        dir=os.path.dirname(filename))
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(get_temp_header())
+            marshal.dump((files, text, code), f)
+        finally:
+            f.close()
+        os.chmod(tmp, 0644)
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
 def register_node(name, node):
     assert issubclass(node, Node)
     __nodes__[name] = node
 
+def register_mark(name, regex):
+    if isinstance(regex, (str, unicode)):
+        regex = re.compile(regex)
+    __marks__[name] = regex
+
+def merge_literals(code, writer='out.write'):
+    """
+    Merge the adjacent literal text writing lines into one line, so that
+    fewer writes will be executed
+    """
+    prefix = writer + '('
+    suffix = ', escape=False)'
+    lines = []
+    texts = []
+    
+    def flush():
+        if len(texts) == 1:
+            lines.append(texts[0][0])
+        elif texts:
+            lines.append('%s%r%s' % (prefix, texts[0][1][:0].join([x[1] for x in texts]), suffix))
+        del texts[:]
+        
+    for line in code.split('\n'):
+        text = None
+        if line.startswith(prefix) and line.endswith(suffix):
+            try:
+                text = ast.literal_eval(line[len(prefix):-len(suffix)])
+            except (ValueError, SyntaxError):
+                pass
+        if isinstance(text, (str, unicode)):
+            if texts and type(texts[0][1]) is not type(text):
+                flush()
+            texts.append((line, text))
+        else:
+            flush()
+            lines.append(line)
+    flush()
+    return '\n'.join(lines)
+
+def remove_block_marks(code):
+    """
+    Remove the block mark lines, so that the literals around block boundaries
+    can be merged
+    """
+    mark = '%r' % BLOCK_MARK
+    return '\n'.join([x for x in code.split('\n') if x != mark])
+
+def _make_flush(node, check):
+    if check:
+        stmt = ast.parse('if out.size >= out.buffer_size: yield out.pop()').body[0]
+    else:
+        stmt = ast.parse('if out.buf: yield out.pop()').body[0]
+    return ast.copy_location(stmt, node)
+
+def _insert_yields(body):
+    """
+    Replace block marks with flush statements, and add size checking flush
+    statements to the end of loops. Functions and classes defined in template
+    will be skipped.
+    """
+    result = []
+    for node in body:
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Str) and node.value.s == BLOCK_MARK:
+            result.append(_make_flush(node, False))
+            continue
+        if not isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            for name in ('body', 'orelse', 'finalbody'):
+                v = getattr(node, name, None)
+                if isinstance(v, list):
+                    setattr(node, name, _insert_yields(v))
+            if isinstance(node, ast.TryExcept):
+                for h in node.handlers:
+                    h.body = _insert_yields(h.body)
+            if isinstance(node, (ast.For, ast.While)):
+                node.body.append(_make_flush(node, True))
+        result.append(node)
+    return result
+
+def get_stream_code(text, filename='template'):
+    """
+    Convert parsed code to a module ast which defines a generator function
+    named STREAM_FUNC, it'll yield the output at block boundaries, and at the 
+    end of loops if the buffer size is reached. The names assigned in the code
+    are declared as global, so the code runs the same as in module level.
+    If the code can't be converted, the text will be returned.
+    """
+    try:
+        tree = ast.parse(text, filename)
+        table = symtable.symtable(text, filename, 'exec')
+    except SyntaxError:
+        return text
+    names = [x.get_name() for x in table.get_symbols() if x.is_assigned() or x.is_imported()]
+    body = _insert_yields(tree.body)
+    if names:
+        body.insert(0, ast.Global(names=names))
+    body.append(_make_flush(tree, False))
+    func = ast.FunctionDef(name=STREAM_FUNC, args=ast.arguments(args=[], 
+        vararg=None, kwarg=None, defaults=[]), body=body, decorator_list=[])
+    tree.body = [func]
+    ast.fix_missing_locations(tree)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', SyntaxWarning)
+            compile(tree, filename, 'exec')
+    except SyntaxError:
+        #e.g. 'from module import *' is not allowed in function
+        return text
+    return tree
+
 def reindent(text):
     lines=text.split('\n')
     new_lines=[]
@@ -80,7 +334,30 @@ def get_templatefile(filename, dirs, default_template=None, skip='', skip_origin
     """
     Fetch the template filename according dirs
     :para skip: if the searched filename equals skip, then using the one before.
+    
+    The result will be cached in path_cache.
     """
+    if isinstance(default_template, list):
+        default_template = tuple(default_template)
+    key = ('template', filename, tuple(dirs or ()), default_template, skip, skip_original)
+    
+    def watch_dirs():
+        names = [filename]
+        if isinstance(default_template, tuple):
+            names.extend(default_template)
+        elif default_template:
+            names.append(default_template)
+        d = []
+        for name in names:
+            d.append(os.path.dirname(name) or '.')
+            for x in dirs or ():
+                d.append(os.path.dirname(os.path.join(x, name)))
+        return d
+    
+    return path_cache.get(key, lambda:_get_templatefile(filename, dirs, 
+        default_template, skip, skip_original), watch_dirs)
+
+def _get_templatefile(filename, dirs, default_template=None, skip='', skip_original=''):
     def _file(filename, dirs):
         for d in dirs:
             _f = os.path.normcase(os.path.join(d, filename))
@@ -152,6 +429,7 @@ def get_tag(begin_tag, end_tag):
         ')')
     return re.compile(r, re.DOTALL|re.M)
 
+r_head_end = re.compile(r'</head\s*>', re.I)
 r_tag = re.compile('^#uliweb-template-tag:(.+?),(.+?)(:\r|\n|\r\n)')
 
 class Node(object):
@@ -217,7 +495,7 @@ class BlockNode(BaseBlockNode):
         if top and self.name in self.content.root.block_vars and self is not self.content.root.block_vars[self.name][-1]:
             return self.content.root.block_vars[self.name][-1].render(False)
         
-        s = []
+        s = ['%r\n' % BLOCK_MARK]
         for x in self.nodes:
             if isinstance(x, BlockNode):
                 if x.name in self.content.root.block_vars:
@@ -226,6 +504,7 @@ class BlockNode(BaseBlockNode):
                     s.append(str(x))
             else:
                 s.append(str(x))
+        s.append('%r\n' % BLOCK_MARK)
         return ''.join(s)
         
 class SuperNode(Node):
@@ -281,6 +560,21 @@ class Content(BaseBlockNode):
             s.append(repr(x))
         return ''.join(s)
 
+def update_dict(d, m):
+    """
+    Update d with mapping m. Chain mapping, e.g. ChainStorage, which has 'maps'
+    attribute will be updated map by map, so the values needn't be read 
+    one by one.
+    """
+    if not isinstance(m, dict):
+        maps = getattr(m, 'maps', None)
+        if isinstance(maps, list):
+            for x in reversed(maps):
+                update_dict(d, x)
+            return d
+    d.update(m)
+    return d
+
 class Context(object):
     "A stack container for variable context"
     def __init__(self, dict_=None):
@@ -352,20 +646,37 @@ class Context(object):
         if not self.dirty:
             return self.result
         else:
-            d = {}
-            for i in reversed(self.dicts):
-                d.update(i)
+            d = self.flatten()
             self.result = d
             self.dirty = False
         return d
+    
+    def flatten(self):
+        "Return a new dict of all the variables"
+        d = {}
+        for i in reversed(self.dicts):
+            update_dict(d, i)
+        return d
         
 __nodes__['block'] = BlockNode
 
+def escape_html(s):
+    """
+    The same as cgi.escape(s), but the string which has nothing to be 
+    escaped will be returned directly
+    """
+    if '&' in s or '<' in s or '>' in s:
+        return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return s
+
 class Out(object):
     encoding = 'utf-8'
+    capturing = 0   #the output is being captured, e.g. by fragment cache
+    marks = None
+    value = None
     
     def __init__(self):
-        self.buf = StringIO.StringIO()
+        self.buf = []
         
     def _str(self, text):
         if not isinstance(text, (str, unicode)):
@@ -376,21 +687,71 @@ class Out(object):
             return text
 
     def write(self, text, escape=True):
-        s = self._str(text)
+        if text.__class__ is not str:
+            text = self._str(text)
         if escape:
-            self.buf.write(cgi.escape(s))
-        else:
-            self.buf.write(s)
+            text = escape_html(text)
+        self.buf.append(text)
             
     def xml(self, text):
-        self.write(self._str(text), escape=False)
+        self.write(text, escape=False)
         
 #    def json(self, text):
 #        from datawrap import dumps
 #        self.write(dumps(text))
 #
+    def mark(self, name):
+        """
+        Record the current position of the output, only the first one will be
+        kept
+        """
+        if self.marks is None:
+            self.marks = {}
+        if name not in self.marks:
+            self.marks[name] = len(self.buf)
+            
+    def get_position(self, name):
+        """
+        Return the position of the mark in the output text, or None if the
+        mark is not found
+        """
+        if not self.marks or name not in self.marks:
+            return None
+        return sum(map(len, self.buf[:self.marks[name]]))
+    
     def getvalue(self):
-        return self.buf.getvalue()
+        self.value = ''.join(self.buf)
+        return self.value
+
+class StreamOut(Out):
+    """
+    Output of stream template, the size of buffered text is counted, so stream
+    code can check it and pop the text out
+    """
+    def __init__(self, buffer_size=None):
+        self.buf = []
+        self.size = 0
+        self.buffer_size = buffer_size or __options__['buffer_size']
+        
+    def write(self, text, escape=True):
+        if text.__class__ is not str:
+            text = self._str(text)
+        if escape:
+            text = escape_html(text)
+        self.buf.append(text)
+        self.size += len(text)
+        
+    def mark(self, name):
+        #the buffer will be popped, so the positions are not kept
+        pass
+    
+    def pop(self):
+        if self.capturing:
+            return ''
+        text = ''.join(self.buf)
+        self.buf = []
+        self.size = 0
+        return text
 
 class Template(object):
     def __init__(self, text='', vars=None, env=None, dirs=None, 
@@ -418,6 +779,9 @@ class Template(object):
         self.begin_tag = begin_tag or BEGIN_TAG
         self.end_tag = end_tag or END_TAG
         self.see = see #will used to track the derive relation of templates
+        #if the parsed code depends on vars or env, e.g. {{embed}} or
+        #{{include name}}, it can't be cached
+        self.cacheable = True
         
         for k, v in __nodes__.iteritems():
             if hasattr(v, 'init'):
@@ -443,6 +807,11 @@ class Template(object):
     def _get_parameters(self, value):
         def _f(*args, **kwargs):
             return args, kwargs
+        #parameters only have literal values will not change the parsed code
+        try:
+            return eval("_f(%s)" % value, {'_f':_f, '__builtins__':{}}, {})
+        except:
+            self.cacheable = False
         d = self.env.to_dict()
         d['_f'] = _f
         try:
@@ -454,7 +823,10 @@ class Template(object):
                 raise
         return args, kwargs
     
-    def parse(self):
+    def parse(self, stream=False):
+        """
+        Return the parsed code, block marks will be kept only if stream is True
+        """
         text = self.text
         extend = None  #if need to process extend node
         for i in get_tag(self.begin_tag, self.end_tag).split(text):
@@ -535,8 +907,7 @@ class Template(object):
                         if line and in_tag:
                             top.add(line+'\n')
                 else:
-                    buf = "%s(%r, escape=False)\n" % (self.writer, i)
-                    top.add(buf)
+                    self._write_text(top, i)
                     
         if extend:
             self._parse_extend(extend)
@@ -544,8 +915,30 @@ class Template(object):
             pre = '#coding=%s\n' % self.encoding
         else:
             pre = ''
-        return reindent(pre + str(self.content))
+        code = str(self.content)
+        if not stream:
+            code = remove_block_marks(code)
+        return reindent(pre + merge_literals(code, self.writer))
     
+    def _write_text(self, content, text):
+        """
+        Add literal text writing code, and if registered marks are found in 
+        the text, mark code will be added at the positions
+        """
+        points = []
+        for name, r in __marks__.iteritems():
+            b = r.search(text)
+            if b:
+                points.append((b.end(), name))
+        pos = 0
+        for p, name in sorted(points):
+            if p > pos:
+                content.add("%s(%r, escape=False)\n" % (self.writer, text[pos:p]))
+                pos = p
+            content.add("out.mark(%r)\n" % name)
+        if pos < len(text):
+            content.add("%s(%r, escape=False)\n" % (self.writer, text[pos:]))
+        
     def _parse_template(self, content, var):
         if var in self.vars:
             v = self.vars[var]
@@ -565,6 +958,7 @@ class Template(object):
         return False
 
     def _parse_text(self, content, var):
+        self.cacheable = False
         try:
             text = str(eval(var, self.env.to_dict(), self.vars))
         except:
@@ -600,7 +994,11 @@ class Template(object):
             t = Template(text, self.vars, self.env, self.dirs, begin_tag=begin_tag, end_tag=end_tag, see=self.see)
             t.set_filename(fname)
             t.add_root(self)
-            t.parse()
+            try:
+                t.parse()
+            finally:
+                self.cacheable = self.cacheable and t.cacheable
+            self.depend_files.extend(t.depend_files)
             content.merge(t.content)
         finally:
             self.env.pop()
@@ -631,39 +1029,36 @@ class Template(object):
             t = Template(text, self.vars, self.env, self.dirs, begin_tag=begin_tag, end_tag=end_tag, see=self.see)
             t.set_filename(fname)
             t.add_root(self)
-            t.parse()
+            try:
+                t.parse()
+            finally:
+                self.cacheable = self.cacheable and t.cacheable
+            self.depend_files.extend(t.depend_files)
             self.content.clear_content()
             t.content.merge(self.content)
             self.content = t.content
         finally:
             self.env.pop()
             
-    def get_parsed_code(self):
-        if self.use_temp:
+    def get_parsed_code(self, stream=False):
+        """
+        Return (use_temp_flag, filename, text), if the compiled template is
+        loaded from temp dir, the code object will be saved in self.code.
+        If stream is True, the text will keep block marks, and it'll not be
+        loaded from temp dir, because the saved text has no block marks.
+        """
+        self.code = self.code_files = None
+        if self.use_temp and not stream:
             f = get_temp_template(self.filename)
-            if os.path.exists(f):
-                fin = file(f, 'r')
-                modified = False
-                files = [self.filename]
-                line = fin.readline()
-                if line.startswith('#uliweb-template-files:'):
-                    files.extend(line[1:].split())
-                else:
-                    fin.seek(0)
-                
-                for x in files:
-                    if os.path.getmtime(x) > os.path.getmtime(f):
-                        modified = True
-                        break
-                    
-                if not modified:
-                    text = fin.read()
-                    fin.close()
-                    return True, f, text
+            v = load_temp_template(f)
+            if v:
+                self.code_files, text, self.code = v
+                self.depend_files = [x[0] for x in self.code_files[1:]]
+                return True, self.filename, text
         
         if self.filename and not self.text:
             self.text, self.begin_tag, self.end_tag = self.get_text(file(self.filename, 'rb').read())
-        return False, self.filename, self.parse()
+        return False, self.filename, self.parse(stream)
         
     def get_text(self, text, inherit_tags=True):
         """
@@ -684,22 +1079,119 @@ class Template(object):
                 end_tag = END_TAG
         return text, begin_tag, end_tag
     
+    def get_cache_key(self):
+        """
+        Only template file without custom compile function will be cached
+        """
+        if not self.filename or self.text or self.compile:
+            return None
+        if isinstance(self.dirs, list):
+            dirs = tuple(self.dirs)
+        else:
+            dirs = self.dirs
+        return (self.filename, dirs, self.begin_tag, self.end_tag, self.encoding)
+    
     def __call__(self):
-        use_temp_flag, filename, code = self.get_parsed_code()
+        code, filename = self.get_code()
+        return self._run(code, filename)
+    
+    def stream(self, buffer_size=None):
+        """
+        Render the template as an iterator of text chunks. Callbacks can only
+        process the head section, so the output will be buffered until 
+        </head> is found if there are callbacks.
+        """
+        code, filename = self.get_code(stream=True)
+        out = StreamOut(buffer_size)
+        e = self._get_env(out)
+        exec self._compile_code(code, filename, e) in e
+        if STREAM_FUNC in e:
+            chunks = e[STREAM_FUNC]()
+        else:
+            #the code can't be converted to stream code, so it's executed
+            chunks = [out.pop()]
+        return self._iter_chunks(chunks, e)
+    
+    def _iter_chunks(self, chunks, e):
+        if not self.callbacks:
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+            return
         
-        if not use_temp_flag and self.use_temp:
-            f = get_temp_template(filename)
-            try:
-                fo = file(f, 'wb')
-                fo.write('#uliweb-template-files:%s\n' % ' '.join(self.depend_files))
-                fo.write(code)
-                fo.close()
-            except:
-                pass
+        head = ''
+        for chunk in chunks:
+            if head is None:
+                if chunk:
+                    yield chunk
+                continue
+            pos = max(len(head) - 10, 0)
+            head += chunk
+            b = r_head_end.search(head, pos)
+            if b:
+                yield self._process_callbacks(head[:b.end()], e) + head[b.end():]
+                head = None
+        if head is not None:
+            yield self._process_callbacks(head, e)
         
-        return self._run(code, filename or 'template')
+    def get_code(self, stream=False):
+        """
+        Return (code, filename), code may be parsed text, ast or compiled code
+        object. If stream is True, the code will define a generator function
+        which can be used to render the template in stream mode.
+        """
+        key = self.get_cache_key()
+        if key and stream:
+            key = key + ('stream',)
+        if key:
+            v = __compiled_templates__.get(key)
+            if v:
+                code, files = v
+                if not __options__['check_files'] or not is_files_changed(files):
+                    return code, self.filename
+                __compiled_templates__.remove(key)
+            
+        use_temp_flag, filename, text = self.get_parsed_code(stream)
+        filename = filename or 'template'
         
-    def _run(self, code, filename):
+        code, files = text, None
+        if stream:
+            code = get_stream_code(text, filename)
+        if self.compile:
+            #custom compile function should always be used
+            pass
+        elif use_temp_flag:
+            files = self.code_files
+            code = self.code
+        elif self.cacheable and (key or self.use_temp):
+            files = get_files_mtime([self.filename] + self.depend_files)
+            if files:
+                code = compile(code, filename, 'exec')
+                if self.use_temp and not stream:
+                    try:
+                        save_temp_template(get_temp_template(filename), files, text, code)
+                    except:
+                        pass
+        
+        if key and files:
+            __compiled_templates__.set(key, (code, files))
+            
+        return code, filename
+        
+    def _compile_code(self, code, filename, e):
+        if not isinstance(code, types.CodeType):
+            if self.compile:
+                code = self.compile(code, filename, 'exec', e)
+            else:
+                code = compile(code, filename, 'exec')
+        return code
+    
+    def _process_callbacks(self, text, e):
+        for f in self.callbacks:
+            text = f(text, self, self.vars, e)
+        return text
+        
+    def _get_env(self, out):
         def f(_vars, _env):
             def defined(v, default=None):
                 _v = default
@@ -710,14 +1202,11 @@ class Template(object):
                 return _v
             return defined
 
-        e = {}
         if isinstance(self.env, Context):
-            new_e = self.env.to_dict()
+            e = self.env.flatten()
         else:
-            new_e = self.env
-        e.update(new_e)
+            e = update_dict({}, self.env)
         e.update(self.vars)
-        out = Out()
         e['out'] = out
         e['Out'] = Out
         e['xml'] = out.xml
@@ -726,25 +1215,51 @@ class Template(object):
         e['_env'] = e
         
         e.update(self.exec_env)
-        
-        if isinstance(code, (str, unicode)):
-            if self.compile:
-                code = self.compile(code, filename, 'exec', e)
-            else:
-                code = compile(code, filename, 'exec')
-        exec code in e
-        text = out.getvalue()
-        
-        for f in self.callbacks:
-            text = f(text, self, self.vars, e)
-
-        return text
+        return e
+    
+    def _run(self, code, filename):
+        out = Out()
+        e = self._get_env(out)
+        exec self._compile_code(code, filename, e) in e
+        return self._process_callbacks(out.getvalue(), e)
     
 def template_file(filename, vars=None, env=None, dirs=None, default_template=None, compile=None, **kwargs):
     t = Template('', vars, env, dirs, default_template, use_temp=__options__['use_temp_dir'], compile=compile, **kwargs)
     t.set_filename(filename)
     return t()
 
+def stream_file(filename, vars=None, env=None, dirs=None, default_template=None, compile=None, buffer_size=None, **kwargs):
+    """
+    Render the template file in stream mode, it'll return an iterator of text
+    chunks
+    """
+    t = Template('', vars, env, dirs, default_template, use_temp=__options__['use_temp_dir'], compile=compile, **kwargs)
+    t.set_filename(filename)
+    return t.stream(buffer_size)
+
 def template(text, vars=None, env=None, dirs=None, default_template=None, **kwargs):
     t = Template(text, vars, env, dirs, default_template, **kwargs)
     return t()
+
+def compile_file(filename, vars=None, env=None, dirs=None, default_template=None, **kwargs):
+    """
+    Parse and compile the template file, and save the compiled code to temp
+    dir, so it can be loaded directly when rendering. Return the resolved 
+    filename, or None if the template depends on vars and can't be cached.
+    """
+    t = Template('', vars, env, dirs, default_template, **kwargs)
+    t.set_filename(filename)
+    try:
+        use_temp_flag, fname, text = t.get_parsed_code()
+    except:
+        #parsing the template which depends on vars may fail
+        if not t.cacheable:
+            return None
+        raise
+    if not t.cacheable:
+        return None
+    code = compile(text, t.filename, 'exec')
+    files = get_files_mtime([t.filename] + t.depend_files)
+    if files:
+        save_temp_template(get_temp_template(t.filename), files, text, code)
+    return t.filename
@@ -0,0 +1,152 @@
+####################################################################
+# Author: Limodou@gmail.com
+# License: BSD
+####################################################################
+
+"""
+Per request phase timing. When [TIMING]/ENABLE is True, Dispatcher will
+record the time spent in url matching, each middleware, view calling,
+template rendering and orm executing, then the timings will be passed to
+the collector and the `request_timing` dispatch topic.
+
+Phases can be nested, e.g. template and orm time are also counted in view.
+"""
+
+import time
+import threading
+from collections import deque
+
+__all__ = ['Timings', 'Collector', 'get_timings', 'set_timings', 'null_timings']
+
+_local = threading.local()
+
+class _Phase(object):
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.begin = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.timings.add(self.name, time.time() - self.begin)
+
+class Timings(object):
+    """
+    Record the durations of request phases, the same named phases will be
+    accumulated. It can be used as:
+
+        with timings('view'):
+            ...
+    """
+    def __init__(self):
+        self.begin = time.time()
+        self.end = None
+        self.names = []
+        self.durations = {}
+        self.counts = {}
+
+    def __nonzero__(self):
+        return True
+
+    def __call__(self, name):
+        if not isinstance(name, (str, unicode)):
+            #bound method, e.g. middleware.process_request
+            name = '%s.%s' % (name.im_self.__class__.__name__, name.__name__)
+        return _Phase(self, name)
+
+    def add(self, name, duration):
+        if name not in self.durations:
+            self.names.append(name)
+            self.durations[name] = duration
+            self.counts[name] = 1
+        else:
+            self.durations[name] += duration
+            self.counts[name] += 1
+
+    def stop(self):
+        self.end = time.time()
+
+    @property
+    def total(self):
+        return (self.end or time.time()) - self.begin
+
+    def items(self):
+        """
+        Return [(name, duration, count)] in recording order
+        """
+        return [(x, self.durations[x], self.counts[x]) for x in self.names]
+
+    def server_timing(self):
+        """
+        Format as the value of Server-Timing header, duration is in milliseconds
+        """
+        s = ['%s;dur=%.3f' % (name, duration*1000) for name, duration, count in self.items()]
+        s.append('total;dur=%.3f' % (self.total*1000))
+        return ', '.join(s)
+
+class NullTimings(object):
+    """
+    Used when timing is disabled, all the methods do nothing
+    """
+    def __nonzero__(self):
+        return False
+
+    def __call__(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def add(self, name, duration):
+        pass
+
+null_timings = NullTimings()
+
+def get_timings():
+    """
+    Get the timings of current request, if timing is disabled, it'll return
+    null_timings
+    """
+    return getattr(_local, 'timings', null_timings)
+
+def set_timings(timings):
+    _local.timings = timings or null_timings
+
+class Collector(object):
+    """
+    Default timing collector, it'll add Server-Timing header to response if
+    [TIMING]/SERVER_TIMING is True, and keep the latest slow requests, whose
+    total time is not less than [TIMING]/SLOW_TIME seconds, in a ring buffer.
+    """
+    def __init__(self, application, settings):
+        self.application = application
+        self.settings = settings
+        self.server_timing = settings.get_var('TIMING/SERVER_TIMING', False)
+        self.slow_time = settings.get_var('TIMING/SLOW_TIME', 0.5)
+        self.slow_requests = deque(maxlen=settings.get_var('TIMING/SLOW_REQUESTS', 100))
+
+    def collect(self, request, response, timings):
+        if self.server_timing and hasattr(response, 'headers'):
+            response.headers['Server-Timing'] = timings.server_timing()
+        if timings.total >= self.slow_time:
+            rule = getattr(request, 'rule', None)
+            self.slow_requests.append({
+                'time':timings.begin,
+                'method':request.method,
+                'url':request.url,
+                'endpoint':rule and rule.endpoint,
+                'total':timings.total,
+                'phases':timings.items(),
+            })
+        return response
+
+    def get_slow_requests(self):
+        """
+        Return the slow requests, the latest one is the first
+        """
+        return list(reversed(self.slow_requests))
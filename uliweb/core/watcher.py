@@ -0,0 +1,115 @@
+####################################################################
+# Author: Limodou@gmail.com
+# License: BSD
+####################################################################
+
+"""
+File watcher. It polls the mtimes of the watched files and directories in a
+background thread, and the changed paths will be passed to the callbacks, so
+the caches which depend on files can be invalidated by the watcher, and the
+request processing needn't stat the files any more.
+
+Directories are watched recursively, the names started with '.' will be
+skipped.
+"""
+
+import os
+import threading
+from uliweb.utils.common import log
+
+__all__ = ['Watcher']
+
+class Watcher(object):
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.paths = []
+        self.callbacks = []
+        self.mtimes = {}
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def watch(self, path):
+        path = os.path.abspath(path)
+        if path not in self.paths:
+            self.paths.append(path)
+            self.mtimes.update(self.scan_path(path))
+
+    def add_callback(self, callback):
+        """
+        callback(changed) will be invoked in watcher thread, changed is the
+        list of changed, created or removed paths
+        """
+        self.callbacks.append(callback)
+
+    def scan_path(self, path):
+        mtimes = {}
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [x for x in dirs if not x.startswith('.')]
+                for x in [root] + [os.path.join(root, y) for y in files if not y.startswith('.')]:
+                    try:
+                        mtimes[x] = os.stat(x).st_mtime
+                    except OSError:
+                        pass
+        elif os.path.exists(path):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def scan(self):
+        mtimes = {}
+        for x in self.paths:
+            mtimes.update(self.scan_path(x))
+        return mtimes
+
+    def check(self):
+        """
+        Scan the watched paths once, and call the callbacks if there are
+        changes. Return the changed paths.
+        """
+        mtimes = self.scan()
+        changed = sorted([x for x in set(mtimes) | set(self.mtimes)
+            if mtimes.get(x) != self.mtimes.get(x)])
+        self.mtimes = mtimes
+        if changed:
+            for c in self.callbacks:
+                try:
+                    c(changed)
+                except Exception, e:
+                    log.exception(e)
+        return changed
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def is_running(self):
+        """
+        Return True if the watcher thread is running in current process
+        """
+        return (self.pid == os.getpid() and self.thread is not None 
+            and self.thread.isAlive())
+
+    def start(self):
+        """
+        Start the watcher thread if it's not running in current process, because
+        threads will not be copied after fork
+        """
+        if self.is_running():
+            return
+        with self.lock:
+            if self.is_running():
+                return
+            self.pid = os.getpid()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='uliweb-watcher')
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread = None
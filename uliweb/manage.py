@@ -66,7 +66,30 @@ def install_config(apps_dir):
                 p = os.path.abspath(os.path.normpath(p))
                 if not p in sys.path:
                     sys.path.insert(0, p)
+        return c
                     
+def get_manifest_kwargs(apps_dir, config, manifest=None, lazy_views=None):
+    """
+    Return the manifest arguments of Dispatcher. The manifest caches settings,
+    so it can't be enabled in settings.ini, it's configured in apps/config.ini:
+    
+        [GLOBAL]
+        MANIFEST = 'manifest.pkl'
+        LAZY_VIEWS = True
+        
+    Relative manifest filename is based on project directory, the arguments 
+    will override the config values.
+    """
+    if config:
+        manifest = manifest or config.GLOBAL.get('MANIFEST')
+        if lazy_views is None:
+            lazy_views = config.GLOBAL.get('LAZY_VIEWS', False)
+    if not manifest:
+        return {}
+    project_dir = os.path.dirname(os.path.abspath(apps_dir))
+    return {'manifest_file':os.path.join(project_dir, manifest), 
+        'lazy_views':bool(lazy_views)}
+    
 def make_application(debug=None, apps_dir='apps', project_dir=None, 
     include_apps=None, debug_console=True, settings_file='settings.ini', 
     local_settings_file='local_settings.ini', start=True, default_settings=None, 
@@ -77,7 +100,6 @@ def make_application(debug=None, apps_dir='apps', project_dir=None,
     from uliweb.utils.common import import_attr
     
     dispatcher_cls = dispatcher_cls or SimpleFrame.Dispatcher
-    dispatcher_kwargs = dispatcher_kwargs or {}
     
     if project_dir:
         apps_dir = os.path.normpath(os.path.join(project_dir, 'apps'))
@@ -85,7 +107,10 @@ def make_application(debug=None, apps_dir='apps', project_dir=None,
     if apps_dir not in sys.path:
         sys.path.insert(0, apps_dir)
         
-    install_config(apps_dir)
+    config = install_config(apps_dir)
+    kwargs = get_manifest_kwargs(apps_dir, config)
+    kwargs.update(dispatcher_kwargs or {})
+    dispatcher_kwargs = kwargs
     
     application = app = dispatcher_cls(apps_dir=apps_dir, 
         include_apps=include_apps, 
@@ -478,21 +503,29 @@ class RunserverCommand(Command):
             help='The SSL private key filename.'),
         make_option('--ssl-cert', dest='ssl_cert', default='ssl.cert',
             help='The SSL certificate filename.'),
+        make_option('--manifest', dest='manifest', default=None,
+            help='The startup manifest filename, relative path is based on project directory. Default is MANIFEST of apps/config.ini.'),
+        make_option('--lazy-views', dest='lazy_views', action='store_true', default=None,
+            help='Import views modules at the first request, it only works with a valid manifest.'),
     )
     develop = False
     
     def handle(self, options, global_options, *args):
         from werkzeug.serving import run_simple
 
+        dispatcher_kwargs = get_manifest_kwargs(global_options.apps_dir, 
+            install_config(global_options.apps_dir), options.manifest, options.lazy_views)
         if self.develop:
             include_apps = ['plugs.develop']
             app = make_application(options.debug, project_dir=global_options.project, 
                         include_apps=include_apps, settings_file=global_options.settings,
-                        local_settings_file=global_options.local_settings)
+                        local_settings_file=global_options.local_settings,
+                        dispatcher_kwargs=dispatcher_kwargs)
         else:
             app = make_application(options.debug, project_dir=global_options.project,
                 settings_file=global_options.settings,
-                local_settings_file=global_options.local_settings)
+                local_settings_file=global_options.local_settings,
+                dispatcher_kwargs=dispatcher_kwargs)
             include_apps = []
         extra_files = collect_files(global_options.apps_dir, self.get_apps(global_options, include_apps))
         
@@ -690,6 +723,163 @@ class FindCommand(Command):
         print model_path
 register_command(FindCommand)
 
+class DumpProfileCommand(Command):
+    name = 'dumpprofile'
+    help = 'Dump the stacks collected by SamplingProfileApplication in flamegraph collapsed format.'
+    args = ''
+    check_apps_dirs = False
+    has_options = True
+    option_list = (
+        make_option('-d', dest='dir', default='./profile',
+            help='The dump_dir of SamplingProfileApplication. Default is ./profile.'),
+        make_option('-o', dest='output', 
+            help='Output filename. Default is stdout.'),
+        make_option('-e', dest='endpoint', 
+            help='Only dump the stacks of the endpoint.'),
+        make_option('-w', dest='wait', type='float', default=5,
+            help='Let the running samplers dump the current stacks, and wait for them at most WAIT seconds. 0 means only reading the dumped files. Default is 5.'),
+    )
+    
+    def handle(self, options, global_options, *args):
+        import glob
+        from uliweb.wsgi.profile import request_dump
+        
+        if options.wait > 0:
+            request_dump(options.dir, options.wait)
+        
+        stacks = {}
+        for filename in glob.glob(os.path.join(options.dir, 'sampling-*.txt')):
+            for line in open(filename, 'rb'):
+                line = line.rstrip()
+                if not line:
+                    continue
+                stack, count = line.rsplit(' ', 1)
+                if options.endpoint and stack.split(';', 1)[0] != options.endpoint:
+                    continue
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+        
+        if options.output:
+            f = open(options.output, 'wb')
+        else:
+            f = sys.stdout
+        for stack in sorted(stacks):
+            f.write('%s %d\n' % (stack, stacks[stack]))
+        if options.output:
+            f.close()
+            if global_options.verbose:
+                print 'Dump %d stacks to %s' % (len(stacks), options.output)
+register_command(DumpProfileCommand)
+
+class MakeManifestCommand(Command):
+    name = 'makemanifest'
+    help = 'Create the startup manifest, it can be used with lazy views mode.'
+    args = ''
+    check_apps_dirs = True
+    has_options = True
+    option_list = (
+        make_option('-o', dest='output', default='manifest.pkl',
+            help='Output manifest filename, relative path is based on project directory. Default is manifest.pkl.'),
+    )
+    
+    def handle(self, options, global_options, *args):
+        project_dir = os.path.abspath(global_options.project)
+        filename = os.path.join(project_dir, options.output)
+        if os.path.exists(filename):
+            os.remove(filename)
+        make_simple_application(project_dir=project_dir, 
+            settings_file=global_options.settings, 
+            local_settings_file=global_options.local_settings,
+            dispatcher_kwargs={'manifest_file':filename})
+        if global_options.verbose:
+            from uliweb import application
+            print 'Save %d apps and %d url rules to %s' % (len(application.apps), 
+                len(application.url_rules), filename)
+register_command(MakeManifestCommand)
+
+def _init_compile_worker(project_dir, settings_file, local_settings_file, temp_dir):
+    from uliweb.core import template
+    
+    if not SimpleFrame.Dispatcher.installed:
+        make_simple_application(project_dir=project_dir, settings_file=settings_file, 
+            local_settings_file=local_settings_file)
+    template.use_tempdir(temp_dir)
+    
+def _compile_template(args):
+    from uliweb.core import template
+    
+    name, dirs = args
+    try:
+        if template.compile_file(name, dirs=dirs):
+            return name, 'ok', ''
+        else:
+            return name, 'skip', 'depends on vars'
+    except Exception, e:
+        return name, 'error', '%s: %s' % (e.__class__.__name__, e)
+    
+class CompileTemplatesCommand(Command):
+    name = 'compiletemplates'
+    help = 'Compile the templates of all installed apps to template temp directory.'
+    args = ''
+    check_apps_dirs = True
+    has_options = True
+    option_list = (
+        make_option('-d', dest='dir', 
+            help='Template temp directory. Default is [TEMPLATE] TEMPLATE_TEMP_DIR.'),
+        make_option('-e', dest='exts', action='append', default=[],
+            help='Template file extension, it can be used multiple times. Default is [GLOBAL] TEMPLATE_SUFFIX.'),
+        make_option('-n', dest='processes', type='int', default=0,
+            help='The number of worker processes. Default is cpu count.'),
+    )
+    
+    def handle(self, options, global_options, *args):
+        from multiprocessing import Pool, cpu_count
+        
+        self.get_application(global_options)
+        from uliweb import application, settings
+        
+        temp_dir = os.path.join(global_options.project, 
+            options.dir or settings.TEMPLATE.get('TEMPLATE_TEMP_DIR', 'tmp/templates_temp'))
+        exts = options.exts or [settings.GLOBAL.TEMPLATE_SUFFIX]
+        
+        #collect the template names, the same name in latter directory will
+        #be overrided, so just compile the one which will be found first
+        names = []
+        for d in application.template_dirs:
+            for root, dirs, files in os.walk(d):
+                for f in files:
+                    if os.path.splitext(f)[1] not in exts:
+                        continue
+                    name = os.path.relpath(os.path.join(root, f), d).replace('\\', '/')
+                    if name not in names:
+                        names.append(name)
+        
+        jobs = [(x, application.template_dirs) for x in names]
+        init_args = (global_options.project, global_options.settings, 
+            global_options.local_settings, temp_dir)
+        processes = options.processes or cpu_count()
+        if processes > 1 and len(jobs) > 1:
+            pool = Pool(processes, _init_compile_worker, init_args)
+            try:
+                result = pool.map(_compile_template, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_compile_worker(*init_args)
+            result = map(_compile_template, jobs)
+        
+        count = {'ok':0, 'skip':0, 'error':0, 'dir':temp_dir}
+        for name, status, message in result:
+            count[status] += 1
+            if status == 'error':
+                log.error('Compile template %s failed, %s' % (name, message))
+            elif global_options.verbose:
+                print '%s %s %s' % (status, name, message)
+        print 'Compiled %(ok)d templates to %(dir)s, skipped %(skip)d, failed %(error)d' % count
+        if count['error']:
+            sys.exit(1)
+register_command(CompileTemplatesCommand)
+
 def collect_files(apps_dir, apps):
     files = [os.path.join(apps_dir, 'settings.ini'), 
         os.path.join(apps_dir, 'local_settings.ini')]
@@ -33,6 +33,8 @@ __models__ = {}
 __model_paths__ = {}
 __pk_type__ = 'int'
 __default_tablename_converter__ = None
+__fetch_chunk_size__ = 500
+__returning_dialects__ = ('postgresql',)
 
 import decimal
 import threading
@@ -43,6 +45,7 @@ from sqlalchemy.sql import select, ColumnElement
 from sqlalchemy.pool import NullPool
 import sqlalchemy.engine.base as EngineBase
 from uliweb.core import dispatch
+from uliweb.core.timing import get_timings
 import threading
 
 Local = threading.local()
@@ -312,6 +315,12 @@ def local_conection(ec, auto_transaction=False):
         raise Error("Connection %r should be existed engine name or valid Connection object" % ec)
     return conn
     
+def support_returning(dialect):
+    """
+    Check if the dialect supports multiple rows INSERT ... RETURNING
+    """
+    return bool(dialect.implicit_returning and dialect.name in __returning_dialects__)
+    
 def reset_local_connection(ec):
     """
     """
@@ -343,7 +352,8 @@ def do_(query, ec=None):
     then auto created an connection, and auto begin transaction
     """
     conn = local_conection(ec)
-    return conn.execute(query)
+    with get_timings()('orm'):
+        return conn.execute(query)
     
 def Begin(ec=None):
     ec = ec or 'default'
@@ -674,7 +684,11 @@ class Property(object):
             return self
 
         try:
-            return getattr(model_instance, self._attr_name(), self.default_value())
+            return getattr(model_instance, self._attr_name())
+        except AttributeError:
+            pass
+        try:
+            return self.default_value()
         except AttributeError:
             return None
         
@@ -685,8 +699,18 @@ class Property(object):
         value = self.validate(value)
         #add value to model_instance._changed_value, so that you can test if
         #a object really need to save
+        self._set_changed(model_instance)
         setattr(model_instance, self._attr_name(), value)
 
+    def _set_changed(self, model_instance):
+        """
+        Save the old value when the property is set first time after the
+        object is saved, so put() only needs to check the changed properties
+        """
+        changed = getattr(model_instance, '_changed_values', None)
+        if changed is not None and self.property_name not in changed:
+            changed[self.property_name] = getattr(model_instance, self._attr_name(), None)
+
 #    def default_value(self, model_instance=None):
 #        if callable(self.default):
 #            return self.default(model_instance)
@@ -1199,6 +1223,7 @@ class ReferenceProperty(Property):
     def __set__(self, model_instance, value):
         """Set reference."""
         value = self.validate(value)
+        self._set_changed(model_instance)
         if value is not None:
             if not isinstance(value, Model):
                 setattr(model_instance, self._attr_name(), value)
@@ -1306,6 +1331,99 @@ def get_objs_columns(objs, field='id'):
             ids.append(_id)
     return ids
 
+def get_related_paths(paths):
+    """
+    Convert ['author', 'author.group', 'category'] to
+    {'author':{'group':{}}, 'category':{}}
+    """
+    tree = {}
+    for path in paths:
+        d = tree
+        for x in path.split('.'):
+            d = d.setdefault(x, {})
+    return tree
+
+def resolve_references(model, objs, paths):
+    """
+    Fetch the Reference fields of objs in batch, and save them to the
+    resolved attributes of objs, so ReferenceProperty.__get__ will not query
+    the database any more. paths can be a list of field names or a tree
+    returned by get_related_paths. Each reference field will be fetched via
+    one IN query.
+    """
+    if not isinstance(paths, dict):
+        paths = get_related_paths(paths)
+    for name, sub in paths.items():
+        prop = model.properties.get(name)
+        if not isinstance(prop, ReferenceProperty) or isinstance(prop, ManyToMany):
+            raise KindError('Property %s of Model %s is not a Reference field' % (name, model.__name__))
+        attr_name = prop._attr_name()
+        resolved_name = prop._resolved_attr_name()
+        ids = set()
+        for o in objs:
+            if getattr(o, resolved_name, None) is None:
+                _id = getattr(o, attr_name, None)
+                if _id is not None:
+                    ids.add(_id)
+        if ids:
+            cache = {}
+            ref_model = prop.reference_class
+            field = ref_model.c[prop.reference_fieldname]
+            for x in ref_model.filter(field.in_(list(ids))):
+                cache[getattr(x, prop.reference_fieldname)] = x
+            for o in objs:
+                _id = getattr(o, attr_name, None)
+                if _id in cache and getattr(o, resolved_name, None) is None:
+                    setattr(o, resolved_name, cache[_id])
+        if sub:
+            refs = {}
+            for o in objs:
+                r = getattr(o, resolved_name, None)
+                if r is not None:
+                    refs[id(r)] = r
+            resolve_references(prop.reference_class, refs.values(), sub)
+
+def prefetch_manytomany(model, objs, names):
+    """
+    Fetch the ManyToMany fields of objs in batch, the relation table rows
+    of all objs are fetched via one query, and the reference objects are
+    fetched via another one. The ids and objects will be saved to objs, so
+    iterating getattr(obj, name) will not query the database any more.
+    """
+    for name in names:
+        prop = model.properties.get(name)
+        if not isinstance(prop, ManyToMany):
+            raise KindError('Property %s of Model %s is not a ManyToMany field' % (name, model.__name__))
+        prop.init_through()
+        values = set()
+        for o in objs:
+            v = getattr(o, prop.reversed_fieldname, None)
+            if v is not None:
+                values.add(v)
+        
+        relations = {}
+        ids = set()
+        if values:
+            fielda = prop.table.c[prop.fielda]
+            fieldb = prop.table.c[prop.fieldb]
+            for a, b in do_(select([fielda, fieldb], fielda.in_(list(values))), model.get_connection()):
+                relations.setdefault(a, []).append(b)
+                ids.add(b)
+        
+        cache = {}
+        if ids:
+            ref_model = prop.reference_class
+            field = ref_model.c[prop.reference_fieldname]
+            for x in ref_model.filter(field.in_(list(ids))):
+                cache[getattr(x, prop.reference_fieldname)] = x
+        
+        attr_name = prop._attr_name()
+        prefetched_name = prop._prefetched_attr_name()
+        for o in objs:
+            r = relations.get(getattr(o, prop.reversed_fieldname, None), [])
+            setattr(o, attr_name, r)
+            setattr(o, prefetched_name, (r, [cache[x] for x in r if x in cache]))
+
 class Result(object):
     def __init__(self, model=None, condition=None, *args, **kwargs):
         self.model = model
@@ -1319,6 +1437,9 @@ class Result(object):
         self._group_by = None
         self.distinct_field = None
         self._values_flag = False
+        self._select_related = []
+        self._prefetch_related = []
+        self._row_keys = None
         self.connection = model.get_connection()
         
     def do_(self, query):
@@ -1440,6 +1561,63 @@ class Result(object):
             self.default_query_flag = False
         return self
     
+    def select_related(self, *paths):
+        """
+        Fetch the Reference fields of the result objects in batch, paths
+        can be nested, for example:
+            
+            Article.all().select_related('author', 'author.group', 'category')
+            
+        The objects will be fetched in chunks, and each reference field will
+        be fetched via one IN query for every chunk.
+        """
+        self._select_related.extend(paths)
+        return self
+    
+    def prefetch_related(self, *names):
+        """
+        Fetch the ManyToMany fields of the result objects in batch, for
+        example:
+            
+            Article.all().prefetch_related('tags')
+            
+        For every chunk of objects, the relation table and the reference
+        table will be queried once for each field, and iterating
+        obj.tags will use the fetched objects.
+        """
+        self._prefetch_related.extend(names)
+        return self
+    
+    def related_model(self):
+        return self.model
+    
+    def resolve_related(self, objs):
+        if self._select_related:
+            resolve_references(self.related_model(), objs, self._select_related)
+        if self._prefetch_related:
+            prefetch_manytomany(self.related_model(), objs, self._prefetch_related)
+        
+    def iter_objs(self):
+        """
+        Create objects from self.result, if select_related or prefetch_related
+        is used, the rows will be fetched in chunks
+        """
+        if not (self._select_related or self._prefetch_related) or self._values_flag:
+            while 1:
+                result = self.result.fetchone()
+                if not result:
+                    return
+                yield self.create_obj(result)
+            
+        while 1:
+            rows = self.result.fetchmany(__fetch_chunk_size__)
+            if not rows:
+                return
+            objs = [self.create_obj(x) for x in rows]
+            self.resolve_related(objs)
+            for o in objs:
+                yield o
+            
     def run(self, limit=0):
         query = self.get_query()
         #add limit support
@@ -1465,11 +1643,21 @@ class Result(object):
             query = query.group_by(*self._group_by)
         return query
     
+    def get_row_keys(self, row, offset=0):
+        """
+        Get {column name:index} of the row, it's shared by the rows of the
+        same query
+        """
+        keys = row.keys()
+        if self._row_keys is None or self._row_keys[0] is not keys:
+            self._row_keys = keys, dict([(k, i) for i, k in enumerate(keys[offset:])])
+        return self._row_keys[1]
+    
     def create_obj(self, values):
         if self._values_flag:
             return values
         else:
-            return self.model.create_obj(values.items())
+            return self.model.load_obj(tuple(values), self.get_row_keys(values))
         
     def for_update(self, flag=True):
         """
@@ -1485,7 +1673,10 @@ class Result(object):
         
         result = self.result.fetchone()
         if result:
-            return self.create_obj(result)
+            obj = self.create_obj(result)
+            if not self._values_flag:
+                self.resolve_related([obj])
+            return obj
     
     def clear(self):
         if self.condition is None:
@@ -1501,11 +1692,7 @@ class Result(object):
 
     def __iter__(self):
         self.result = self.run()
-        while 1:
-            result = self.result.fetchone()
-            if not result:
-                raise StopIteration
-            yield self.create_obj(result)
+        return self.iter_objs()
   
 class ReverseResult(Result):
     def __init__(self, model, condition, a_field, b_table, instance, b_field, *args, **kwargs):
@@ -1524,6 +1711,9 @@ class ReverseResult(Result):
         self._group_by = None
         self.distinct_field = None
         self._values_flag = False
+        self._select_related = []
+        self._prefetch_related = []
+        self._row_keys = None
         self.connection = model.get_connection()
         
     def has(self, *objs):
@@ -1554,10 +1744,12 @@ class ReverseResult(Result):
     
 class ManyResult(Result):
     def __init__(self, modela, instance, property_name, modelb, 
-        table, fielda, fieldb, realfielda, realfieldb, valuea, through_model=None):
+        table, fielda, fieldb, realfielda, realfieldb, valuea, through_model=None,
+        prefetched=None):
         """
         modela will define property_name = ManyToMany(modelb) relationship.
         instance will be modela instance
+        prefetched is (ids, objs) fetched by Result.prefetch_related
         """
         self.modela = modela
         self.instance = instance
@@ -1579,9 +1771,29 @@ class ManyResult(Result):
         self._group_by = None
         self.distinct_field = None
         self._values_flag = False
+        self._select_related = []
+        self._prefetch_related = []
+        self._row_keys = None
+        self.prefetched = prefetched
         self.connection = self.modela.get_connection()
         self.kwargs = {}
         
+    def use_prefetched(self):
+        """
+        If the query is not changed, the prefetched objects can be used
+        """
+        return (self.prefetched is not None and self.condition is None and 
+            not self.funcs and not self.kwargs and self.default_query_flag and
+            not self._values_flag and not self.with_relation_name and
+            self.distinct_field is None and not self._group_by and
+            not self._select_related and not self._prefetch_related)
+    
+    def clear_prefetched(self):
+        if self.prefetched is not None:
+            self.prefetched = None
+            prop = self.modela.properties[self.property_name]
+            setattr(self.instance, prop._prefetched_attr_name(), None)
+        
     def get(self, condition=None):
         if not isinstance(condition, ColumnElement):
             return self.filter(self.modelb.c[self.realfieldb]==condition).one()
@@ -1608,9 +1820,13 @@ class ManyResult(Result):
                 d = {self.fielda:self.valuea, self.fieldb:v}
                 self.do_(self.table.insert().values(**d))
                 modified = modified or True
+        if modified:
+            self.clear_prefetched()
         return modified
          
     def ids(self):
+        if self.prefetched is not None:
+            return list(self.prefetched[0])
         query = select([self.table.c[self.fieldb]], self.table.c[self.fielda]==self.valuea)
         ids = [x[0] for x in self.do_(query)]
         return ids
@@ -1634,6 +1850,8 @@ class ManyResult(Result):
         if ids: #if there are still ids, so delete them
             self.clear(*ids)
             modified = True
+        if modified:
+            self.clear_prefetched()
         return modified
             
     def clear(self, *objs):
@@ -1645,10 +1863,13 @@ class ManyResult(Result):
             self.do_(self.table.delete((self.table.c[self.fielda]==self.valuea) & (self.table.c[self.fieldb].in_(ids))))
         else:
             self.do_(self.table.delete(self.table.c[self.fielda]==self.valuea))
+        self.clear_prefetched()
        
     remove = clear
     
     def count(self):
+        if self.use_prefetched():
+            return len(self.prefetched[1])
         result = self.table.count((self.table.c[self.fielda]==self.valuea) & (self.table.c[self.fieldb] == self.modelb.c[self.realfieldb]) & self.condition).execute()
         count = 0
         if result:
@@ -1726,56 +1947,37 @@ class ManyResult(Result):
             query = query.group_by(*self._group_by)
         return query
     
-    def one(self):
-        self.run(1)
-        if not self.result:
-            return
-        result = self.result.fetchone()
-        if result:
-            if self._values_flag:
-                return result
+    def related_model(self):
+        return self.modelb
+    
+    def create_obj(self, result):
+        if self._values_flag:
+            return result
 
-            offset = 0
-            if self.with_relation_name:
-                offset = len(self.table.columns)
-                
-            o = self.modelb.create_obj(zip(result.keys()[offset:], result.values()[offset:]))
+        offset = 0
+        if self.with_relation_name:
+            offset = len(self.table.columns)
             
-            if self.with_relation_name:
-                r = self.through_model.create_obj(zip(result.keys()[:offset], result.values()[:offset]))
-                setattr(o, self.with_relation_name, r)
-                
-            return o
-
+        o = self.modelb.load_obj(tuple(result)[offset:], self.get_row_keys(result, offset))
+        
+        if self.with_relation_name:
+            r = self.through_model.create_obj(zip(result.keys()[:offset], result.values()[:offset]))
+            setattr(o, self.with_relation_name, r)
+            
+        return o
+        
     def __del__(self):
         if self.result:
             self.result.close()
             self.result = None
     
     def __iter__(self):
+        if self.use_prefetched():
+            return iter(self.prefetched[1])
         self.run()
         if not self.result:
-            raise StopIteration
-
-        offset = 0
-        if self.with_relation_name:
-            offset = len(self.table.columns)
-        
-        while 1:
-            result = self.result.fetchone()
-            if not result:
-                raise StopIteration
-            if self._values_flag:
-                yield result
-                continue
-           
-            o = self.modelb.create_obj(zip(result.keys()[offset:], result.values()[offset:]))
-            
-            if self.with_relation_name:
-                r = self.through_model.create_obj(zip(result.keys()[:offset], result.values()[:offset]))
-                setattr(o, self.with_relation_name, r)
-                
-            yield o
+            return iter([])
+        return self.iter_objs()
         
 class ManyToMany(ReferenceProperty):
     def __init__(self, reference_class=None, verbose_name=None, collection_name=None, 
@@ -1929,7 +2131,8 @@ class ManyToMany(ReferenceProperty):
             reference_id = getattr(model_instance, self.reversed_fieldname, None)
             x = ManyResult(self.model_class, model_instance, self.property_name, self.reference_class, self.table,
                 self.fielda, self.fieldb, self.reversed_fieldname,
-                self.reference_fieldname, reference_id, through_model=self.through)
+                self.reference_fieldname, reference_id, through_model=self.through,
+                prefetched=getattr(model_instance, self._prefetched_attr_name(), None))
             return x
         else:
             return self
@@ -1940,7 +2143,15 @@ class ManyToMany(ReferenceProperty):
         
         if value:
             value = get_objs_columns(value, self.reference_fieldname)
+        self._set_changed(model_instance)
         setattr(model_instance, self._attr_name(), value)
+        setattr(model_instance, self._prefetched_attr_name(), None)
+    
+    def _prefetched_attr_name(self):
+        """
+        Get attribute of the (ids, objs) fetched by Result.prefetch_related
+        """
+        return '_PREFETCHED' + self._attr_name()
     
     def get_value_for_datastore(self, model_instance, cached=False):
         """Get key of reference rather than reference itself."""
@@ -2136,7 +2347,8 @@ class Model(object):
     _c_lock = threading.Lock()
     
     def __init__(self, **kwargs):
-        self._old_values = {}
+        #None means the object is not saved, and changes will not be tracked
+        self._changed_values = None
         
         #compounds fields will be processed in the end
         compounds = []
@@ -2158,12 +2370,68 @@ class Model(object):
                 prop.__set__(self, value)
         
     def set_saved(self):
-        self._old_values = self.to_dict()
+        self._changed_values = {}
+        
+    @property
+    def _old_values(self):
+        """
+        Get the values of the object when it was saved last time, the format
+        is the same as to_dict(), and ManyToMany fields are cached ids
+        """
+        changed = self._changed_values
+        if changed is None:
+            return {}
+        d = self.to_dict()
         for k, v in self.properties.items():
-            if isinstance(v, ManyToMany):
-                t = v.get_value_for_datastore(self, cached=True)
-                self._old_values[k] = t
+            if k in changed:
+                t = changed[k]
+                if not isinstance(v, ManyToMany):
+                    t = self.field_str(t)
+                d[k] = t
+            elif isinstance(v, ManyToMany):
+                d[k] = v.get_value_for_datastore(self, cached=True)
+        return d
         
+    def __getattr__(self, name):
+        """
+        Decode the value of property from the row lazily, if the object is
+        created via load_obj()
+        """
+        row = self.__dict__.get('_row_')
+        if row is not None:
+            #the object is saved, changes tracking dict is created when it's used
+            if name == '_changed_values':
+                self._changed_values = value = {}
+                return value
+            attrs = self.get_row_attrs()
+            if name in attrs:
+                prop = attrs[name]
+                if prop is None:
+                    value = None
+                else:
+                    keys, values = row
+                    i = keys.get(prop.property_name)
+                    if i is None:
+                        value = prop.default_value()
+                    else:
+                        value = prop.make_value_from_datastore(values[i])
+                        if value is not None:
+                            value = prop.convert(value)
+                self.__dict__[name] = value
+                return value
+        raise AttributeError(name)
+    
+    def __getstate__(self):
+        d = self.__dict__
+        if '_row_' in d:
+            for name in self.get_row_attrs():
+                getattr(self, name)
+            self._changed_values
+            d = d.copy()
+            del d['_row_']
+        return d
+    
+
     def to_dict(self, fields=None, convert=True, manytomany=False):
         d = {}
         fields = fields or []
@@ -2224,10 +2492,16 @@ class Model(object):
         else:
             d = {}
             d['id'] = self.id
-            for k, v in self.properties.items():
+            #only the changed properties need to be checked, if the object
+            #is not saved via put() or loaded from database, all properties
+            #will be checked
+            changed = self._changed_values
+            if changed is None:
+                changed = dict.fromkeys(self.properties)
+            for k, t in changed.items():
+                v = self.properties[k]
                 if v.property_type == 'compound':
                     continue
-                t = self._old_values.get(k, None)
                 if not isinstance(v, ManyToMany):
                     x = v.get_value_for_datastore(self)
                     #todo If need to support ManyToMany and Reference except id field?
@@ -2235,7 +2509,7 @@ class Model(object):
                         x = x.id
                 else:
                     x = v.get_value_for_datastore(self, cached=True)
-                if t != self.field_str(x):
+                if self.field_str(t) != self.field_str(x):
                     d[k] = x
         
         return d
@@ -2263,12 +2537,14 @@ class Model(object):
         created = False
         d = self._get_data()
         if d:
+            if get_dispatch_send() and self.__dispatch_enabled__:
+                old_values = self._old_values
             if not self.id or insert:
                 created = True
                 old = d.copy()
                 
                 if get_dispatch_send() and self.__dispatch_enabled__:
-                    dispatch.call(self.__class__, 'pre_save', instance=self, created=True, data=d, old_data=self._old_values, signal=self.tablename)
+                    dispatch.call(self.__class__, 'pre_save', instance=self, created=True, data=d, old_data=old_values, signal=self.tablename)
                 
                 #process auto_now_add
                 _manytomany = {}
@@ -2302,7 +2578,7 @@ class Model(object):
                     old = d.copy()
                     
                     if get_dispatch_send() and self.__dispatch_enabled__:
-                        dispatch.call(self.__class__, 'pre_save', instance=self, created=False, data=d, old_data=self._old_values, signal=self.tablename)
+                        dispatch.call(self.__class__, 'pre_save', instance=self, created=False, data=d, old_data=old_values, signal=self.tablename)
 
                     #process auto_now
                     _manytomany = {}
@@ -2332,7 +2608,7 @@ class Model(object):
                     if self.field_str(x) != self.field_str(v):
                         setattr(self, k, v)
                 if get_dispatch_send() and self.__dispatch_enabled__:
-                    dispatch.call(self.__class__, 'post_save', instance=self, created=created, data=old, old_data=self._old_values, signal=self.tablename)
+                    dispatch.call(self.__class__, 'post_save', instance=self, created=created, data=old, old_data=old_values, signal=self.tablename)
                 self.set_saved()
                 
         return saved
@@ -2361,7 +2637,7 @@ class Model(object):
         else:
             do_(self.table.delete(self.table.c.id==self.id), connection or self.get_connection())
             self.id = None
-            self._old_values = {}
+            self._changed_values = None
         if get_dispatch_send() and self.__dispatch_enabled__:
             dispatch.call(self.__class__, 'post_delete', instance=self, signal=self.tablename)
             
@@ -2397,6 +2673,7 @@ class Model(object):
 #            if name in cls.properties:
 #                raise DuplicatePropertyError('Duplicate property: %s' % name)
             cls.properties[name] = prop
+            cls._row_attrs = None
             if config:
                 prop.__property_config__(cls, name)
             if set_property:
@@ -2414,6 +2691,7 @@ class Model(object):
             old_prop = cls.properties[name]
             prop.creation_counter = old_prop.creation_counter
             cls.properties[name] = prop
+            cls._row_attrs = None
             if config:
                 prop.__property_config__(cls, name)
             if set_property:
@@ -2669,6 +2947,110 @@ class Model(object):
     def count(cls, condition=None, connection=None, **kwargs):
         count = do_(cls.table.count(condition, **kwargs), connection or cls.get_connection()).scalar()
         return count
+    
+    @classmethod
+    def bulk_create(cls, objs, batch_size=1000, send_signals=False, return_ids=False, connection=None):
+        """
+        Insert objs in batches via executemany on one connection, objs can be
+        Model instances or dicts. auto_now_add and auto_add fields will be
+        processed the same as put(). pre_save and post_save will be sent only
+        when send_signals is True.
+        
+        If the database supports INSERT ... RETURNING, the ids are always
+        fetched, set to the instances, and the instances are marked as saved.
+        Otherwise the ids are fetched by inserting the rows one by one, it
+        happens when return_ids is True, send_signals is True or objs have
+        ManyToMany values. In other cases the instances are left without ids,
+        so don't save them again, or the rows will be inserted twice. 
+        
+        If return_ids is True, the ids will be returned, otherwise the count 
+        of inserted rows is returned.
+        """
+        conn = local_conection(connection or cls.get_connection())
+        send = send_signals and get_dispatch_send() and cls.__dispatch_enabled__
+        ids = []
+        count = 0
+        batch = []
+        for x in objs:
+            if isinstance(x, dict):
+                x = cls(**x)
+            elif not isinstance(x, cls):
+                raise BadValueError("Can't support the data type %r" % x)
+            batch.append(x)
+            if len(batch) >= batch_size:
+                count += cls._bulk_insert(conn, batch, send, return_ids, ids)
+                batch = []
+        if batch:
+            count += cls._bulk_insert(conn, batch, send, return_ids, ids)
+        if return_ids:
+            return ids
+        return count
+    
+    @classmethod
+    def _bulk_insert(cls, conn, objs, send, return_ids, ids):
+        rows = []
+        olds = []
+        relations = []
+        for o in objs:
+            d = o._get_data()
+            old = d.copy()
+            if send:
+                dispatch.call(cls, 'pre_save', instance=o, created=True, data=d, old_data=o._old_values, signal=cls.tablename)
+            
+            #process auto_now_add
+            _manytomany = {}
+            for k, v in cls.properties.items():
+                if v.property_type == 'compound':
+                    continue
+                if not isinstance(v, ManyToMany):
+                    if isinstance(v, DateTimeProperty) and v.auto_now_add and k not in d:
+                        d[k] = v.now()
+                        setattr(o, k, d[k])
+                    elif (not k in d) and v.auto_add:
+                        d[k] = v.default_value()
+                        setattr(o, k, d[k])
+                else:
+                    if k in d:
+                        _manytomany[k] = d.pop(k)
+                        old.pop(k)
+            rows.append(d)
+            olds.append(old)
+            relations.append(_manytomany)
+        
+        returning = support_returning(conn.dialect)
+        need_ids = returning or return_ids or send or bool(filter(None, relations))
+        new_ids = []
+        with get_timings()('orm'):
+            #executemany needs the same keys, so rows are split by keys
+            i = 0
+            while i < len(rows):
+                keys = set(rows[i])
+                j = i + 1
+                while j < len(rows) and set(rows[j]) == keys:
+                    j += 1
+                if not need_ids:
+                    conn.execute(cls.table.insert(), rows[i:j])
+                elif returning:
+                    r = conn.execute(cls.table.insert().values(rows[i:j]).returning(cls.table.c.id))
+                    new_ids.extend([x[0] for x in r])
+                else:
+                    for d in rows[i:j]:
+                        new_ids.append(conn.execute(cls.table.insert(), d).inserted_primary_key[0])
+                i = j
+        
+        if need_ids:
+            ids.extend(new_ids)
+            for o, _id, _manytomany in zip(objs, new_ids, relations):
+                setattr(o, 'id', _id)
+                for k, v in _manytomany.iteritems():
+                    if v:
+                        getattr(o, k).update(v)
+        for o, old in zip(objs, olds):
+            if send:
+                dispatch.call(cls, 'post_save', instance=o, created=True, data=old, old_data=o._old_values, signal=cls.tablename)
+            if need_ids:
+                o.set_saved()
+        return len(rows)
             
     @classmethod
     def create_obj(cls, values):
@@ -2683,4 +3065,40 @@ class Model(object):
         o.set_saved()
         return o
     
+    @classmethod
+    def load_obj(cls, values, keys):
+        """
+        Create object from database row, values is the tuple of row values,
+        keys is {column name:index}. The row will be saved in the object, and
+        the value of property will be converted when it's accessed first
+        time, validators will not be invoked. If the Model defines its own
+        __init__, create_obj() will be used instead.
+        """
+        if cls.__init__.im_func is not Model.__init__.im_func:
+            return cls.create_obj([(k, values[i]) for k, i in keys.items()])
+        o = cls.__new__(cls)
+        o._row_ = keys, values
+        return o
+    
+    @classmethod
+    def get_row_attrs(cls):
+        """
+        Get {attribute name:property} which can be decoded from row, the
+        attributes of resolved reference and prefetched ManyToMany objects are
+        mapped to None
+        """
+        attrs = cls.__dict__.get('_row_attrs')
+        if attrs is None:
+            attrs = {}
+            for k, v in cls.properties.items():
+                if v.property_type == 'compound':
+                    continue
+                attrs[v._attr_name()] = v
+                if isinstance(v, ManyToMany):
+                    attrs[v._prefetched_attr_name()] = None
+                elif isinstance(v, ReferenceProperty):
+                    attrs[v._resolved_attr_name()] = None
+            cls._row_attrs = attrs
+        return attrs
+    
     
\ No newline at end of file
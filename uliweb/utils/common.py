@@ -211,11 +211,7 @@ def wraps(src):
         def f(*args, **kwargs):
             from uliweb import application
             if application:
-                env = application.get_view_env()
-                for k, v in env.iteritems():
-                    src.func_globals[k] = v
-                
-                src.func_globals['env'] = env
+                application.install_view_env(src.func_globals)
             return des(*args, **kwargs)
         
         f.__name__ = src.__name__
@@ -2005,6 +2005,12 @@ class ListView(SimpleListView):
                 query = query.filter(condition)
         else:
             query = model.filter(condition)
+        if isinstance(query, Result):
+            references, manytomany = self.get_related_fields()
+            if references:
+                query = query.select_related(*references)
+            if manytomany:
+                query = query.prefetch_related(*manytomany)
         if self.pagination:
             if offset is not None:
                 query = query.offset(int(offset))
@@ -2018,6 +2024,24 @@ class ListView(SimpleListView):
                 query = query.order_by(order_by)
         return query
         
+    def get_related_fields(self):
+        """
+        Get the Reference and ManyToMany fields which will be displayed, they
+        will be fetched in batch via select_related and prefetch_related
+        """
+        references = []
+        manytomany = []
+        for x in self.table_info['fields_list']:
+            name = x['name']
+            if name in self.fields_convert_map:
+                continue
+            prop = self.model.properties.get(name)
+            if isinstance(prop, orm.ManyToMany):
+                manytomany.append(name)
+            elif isinstance(prop, orm.ReferenceProperty):
+                references.append(name)
+        return references, manytomany
+        
     def get_table_info(self):
         t = {'fields_name':[], 'fields_list':[], 'fields':[]}
     
@@ -212,6 +212,16 @@ class Ini(SortedDict):
         if self._inifile:
             self.read(self._inifile)
         
+    def __getstate__(self):
+        #env is only used for parsing, and it may be not picklable
+        state = super(Ini, self).__getstate__()
+        state.pop('_env', None)
+        return state
+    
+    def __setstate__(self, state):
+        super(Ini, self).__setstate__(state)
+        self._env = __default_env__.copy()
+        
     def set_filename(self, filename):
         self._inifile = filename
         
@@ -7,6 +7,10 @@ class SortedDict(object):
         return self._dict[key]
     
     def __getattr__(self, key): 
+        #special names should not be treated as keys, e.g. pickle will 
+        #check __getnewargs__
+        if key.startswith('__'):
+            raise AttributeError(key)
         try: 
             return self.__getitem__(key)
         except KeyError, k: 
@@ -91,4 +95,10 @@ class SortedDict(object):
         else:
             self._dict[key] = value
             self._fields.append(key)
-            return value
\ No newline at end of file
+            return value
+        
+    def __getstate__(self):
+        return self.__dict__.copy()
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
\ No newline at end of file
@@ -4,6 +4,7 @@ import hotshot.stats
 from cStringIO import StringIO
 
 PROFILE_DATA_DIR = "./profile"
+DUMP_TRIGGER = 'dump.trigger'
 class ProfileApplication(object):
     def __init__(self, app):
         self.path = path = PROFILE_DATA_DIR
@@ -39,3 +40,256 @@ class ProfileApplication(object):
         
         return ret
         
+
+class Sampler(object):
+    """
+    Statistical sampler, a daemon thread will capture the stacks of the threads
+    which are processing requests every `interval` seconds, and aggregate the
+    samples per endpoint in memory. The samples will be written to 
+    `dump_dir/sampling-<pid>.txt` every `flush_interval` seconds in flamegraph
+    collapsed stacks format, and when `dump_dir/dump.trigger` is touched, 
+    it'll be checked every `trigger_interval` seconds.
+    """
+    def __init__(self, interval=0.005, max_depth=64, dump_dir=PROFILE_DATA_DIR, 
+        flush_interval=10, trigger_interval=1):
+        import threading
+        
+        self.interval = interval
+        self.max_depth = max_depth
+        self.dump_dir = dump_dir
+        self.flush_interval = flush_interval
+        self.trigger_interval = trigger_interval
+        self.trigger_file = os.path.join(dump_dir, DUMP_TRIGGER)
+        self.trigger_mtime = None
+        self.stopped = threading.Event()
+        #protect active and stacks, they are changed by request threads
+        self.lock = threading.Lock()
+        self.active = {}    #thread ident -> samples of current request
+        self.stacks = {}    #endpoint -> {stack:count}
+        self.pid = None
+        self.thread = None
+        #keep the reference, because module globals will be cleared when
+        #interpreter shutdown, but the daemon thread may be still running
+        self.current_frames = sys._current_frames
+        
+    def start(self):
+        """
+        Start the sampler thread if it's not running in current process, because
+        threads will not be copied after fork
+        """
+        import threading
+        
+        if self.pid == os.getpid() and self.thread and self.thread.isAlive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.isAlive():
+                return
+            self.pid = os.getpid()
+            self.active = {}
+            self.stacks = {}
+            #only the trigger touched after starting will cause dumping
+            self.trigger_mtime = self.get_trigger_mtime()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='uliweb-sampler')
+            self.thread.setDaemon(True)
+            self.thread.start()
+        
+    def stop(self):
+        self.stopped.set()
+        
+    def begin(self, ident):
+        with self.lock:
+            self.active[ident] = []
+        
+    def end(self, ident, endpoint):
+        with self.lock:
+            samples = self.active.pop(ident, None)
+            if not samples:
+                return
+            d = self.stacks.setdefault(endpoint, {})
+            for stack in samples:
+                d[stack] = d.get(stack, 0) + 1
+    
+    def get_stack(self, frame):
+        s = []
+        while frame is not None and len(s) < self.max_depth:
+            code = frame.f_code
+            s.append('%s:%d(%s)' % (code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        s.reverse()
+        return ';'.join(s)
+        
+    def sample(self):
+        frames = self.current_frames()
+        with self.lock:
+            for ident, samples in self.active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples.append(self.get_stack(frame))
+    
+    def get_trigger_mtime(self):
+        try:
+            return os.path.getmtime(self.trigger_file)
+        except OSError:
+            return None
+        
+    def is_triggered(self):
+        """
+        Check if the trigger file is touched since last checking
+        """
+        mtime = self.get_trigger_mtime()
+        if mtime is not None and mtime != self.trigger_mtime:
+            self.trigger_mtime = mtime
+            return True
+        return False
+        
+    def run(self):
+        import time
+        
+        last = last_check = time.time()
+        while not self.stopped.isSet():
+            time.sleep(self.interval)
+            try:
+                self.sample()
+                now = time.time()
+                if self.flush_interval and now - last >= self.flush_interval:
+                    self.dump()
+                    last = now
+                elif self.trigger_interval and now - last_check >= self.trigger_interval:
+                    last_check = now
+                    if self.is_triggered():
+                        self.dump()
+                        last = now
+            except:
+                #the sampler should never stop the worker
+                pass
+            
+    def collapsed(self, endpoint=None):
+        """
+        Return collapsed stacks lines, the endpoint will be the root frame
+        """
+        with self.lock:
+            items = [(k, v.copy()) for k, v in self.stacks.items()]
+        lines = []
+        for name, stacks in sorted(items):
+            if endpoint and name != endpoint:
+                continue
+            for stack, count in stacks.items():
+                lines.append('%s;%s %d' % (name, stack, count))
+        return lines
+        
+    def dump(self, filename=None):
+        """
+        Write collapsed stacks to file, the file will be written to a temp
+        file first, then renamed, so that reader will never see half written file
+        """
+        if not filename:
+            if not os.path.exists(self.dump_dir):
+                os.makedirs(self.dump_dir)
+            filename = os.path.join(self.dump_dir, 'sampling-%d.txt' % os.getpid())
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            for line in self.collapsed():
+                f.write(line + '\n')
+        finally:
+            f.close()
+        if sys.platform == 'win32' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+        return filename
+        
+def request_dump(dump_dir=PROFILE_DATA_DIR, timeout=5):
+    """
+    Touch the trigger file to let the samplers of all processes dump their
+    stacks, and wait until the dump files of the running processes are
+    written or timeout. Return the dump files.
+    """
+    import glob
+    import time
+    
+    if not os.path.exists(dump_dir):
+        os.makedirs(dump_dir)
+    trigger = os.path.join(dump_dir, DUMP_TRIGGER)
+    f = open(trigger, 'wb')
+    f.write(str(time.time()))
+    f.close()
+    since = os.path.getmtime(trigger)
+    
+    def is_running(filename):
+        if not hasattr(os, 'kill'):
+            return True
+        try:
+            pid = int(os.path.basename(filename)[9:-4])
+            os.kill(pid, 0)
+        except (ValueError, OSError):
+            return False
+        return True
+    
+    end = time.time() + timeout
+    while True:
+        files = glob.glob(os.path.join(dump_dir, 'sampling-*.txt'))
+        waiting = [x for x in files if os.path.getmtime(x) < since and is_running(x)]
+        if (files and not waiting) or time.time() >= end:
+            return files
+        time.sleep(0.1)
+        
+__sampler__ = None
+
+def get_sampler(**kwargs):
+    """
+    Get the process wide sampler, so that all the middlewares share the same
+    sampler thread
+    """
+    global __sampler__
+    
+    if not __sampler__:
+        __sampler__ = Sampler(**kwargs)
+    return __sampler__
+
+class SamplingProfileApplication(object):
+    """
+    Low overhead statistical profiler, it can be used in production. Enable
+    it in settings.ini:
+        
+        [WSGI_MIDDLEWARES]
+        sampling_profile = 'uliweb.wsgi.profile.SamplingProfileApplication', {'interval':0.01}
+        
+    And run `uliweb dumpprofile` to get flamegraph collapsed stacks, it'll 
+    touch the trigger file to let the samplers dump the current stacks.
+    """
+    def __init__(self, app, interval=0.005, max_depth=64, dump_dir=PROFILE_DATA_DIR, 
+        flush_interval=10, trigger_interval=1):
+        self.app = app
+        self.sampler = get_sampler(interval=interval, max_depth=max_depth, 
+            dump_dir=dump_dir, flush_interval=flush_interval, 
+            trigger_interval=trigger_interval)
+        
+    def get_endpoint(self, environ):
+        from uliweb import request
+        
+        rule = getattr(request, 'rule', None)
+        if rule:
+            endpoint = rule.endpoint
+            if not isinstance(endpoint, (str, unicode)):
+                endpoint = endpoint.__module__ + '.' + endpoint.__name__
+            return endpoint
+        return environ.get('PATH_INFO', '') or '/'
+        
+    def __call__(self, environ, start_response):
+        import thread
+        from werkzeug import ClosingIterator
+        
+        self.sampler.start()
+        ident = thread.get_ident()
+        self.sampler.begin(ident)
+        try:
+            app_iter = self.app(environ, start_response)
+        except:
+            self.sampler.end(ident, self.get_endpoint(environ))
+            raise
+        
+        #the response body may be rendered when it's iterated, so sampling
+        #will be ended when the iterable is closed
+        endpoint = self.get_endpoint(environ)
+        return ClosingIterator(app_iter, lambda:self.sampler.end(ident, endpoint))